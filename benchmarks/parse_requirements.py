@@ -0,0 +1,78 @@
+"""Benchmark parsing the requirements of a pipeline with many processes
+
+Usage:
+    python benchmarks/parse_requirements.py [nprocs] [ncores ...]
+
+For example:
+    python benchmarks/parse_requirements.py 1000 1 2 4 8
+"""
+import sys
+from time import perf_counter
+
+from pipen import Proc
+
+from pipen_cli_require.require import _compile_requirement, _parse_requirements
+
+
+class Template(Proc):
+    """A process with requirements
+
+    Input:
+        a: a
+
+    Output:
+        outfile: out.txt
+
+    Envs:
+        version: The version of the tool
+
+    Requires:
+        tool: Install the tool
+          - check: |
+            {{proc.lang}} -c "import tool; assert tool.__version__ == '{{envs.version}}'"
+        conditional: Install the optional tool
+          - if: {{envs.version | int > 1}}
+          - check: |
+            {{proc.lang}} -c "import optional"
+        heavy: Install the heavy tool
+          - weight: 2
+          - check: |
+            {{proc.lang}} -c "import heavy"
+    """
+
+    input = "a"
+    output = "outfile:file:out.txt"
+    envs = {"version": "1"}
+    lang = sys.executable
+
+
+def build_procs(nprocs):
+    """Build the processes, each a new class with the same docstring"""
+    return [
+        Proc.from_proc(Template, name=f"P{i}", envs={"version": str(i % 3)})
+        for i in range(nprocs)
+    ]
+
+
+def main():
+    nprocs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    all_ncores = [int(n) for n in sys.argv[2:]] or [1, 2, 4, 8]
+
+    print(f"Parsing the requirements of {nprocs} processes")
+    baseline = None
+    for ncores in all_ncores:
+        # New classes, so the annotations cached on them are not reused
+        procs = build_procs(nprocs)
+        _compile_requirement.cache_clear()
+        start = perf_counter()
+        all_reqs = _parse_requirements(procs, ncores)
+        elapsed = perf_counter() - start
+        assert list(all_reqs) == [proc.name for proc in procs]
+        baseline = baseline or elapsed
+        print(
+            f"ncores={ncores:<3} {elapsed:8.3f}s  speedup={baseline / elapsed:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
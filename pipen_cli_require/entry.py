@@ -2,18 +2,65 @@
 
 from __future__ import annotations
 
+from argparse import ArgumentTypeError
+from pathlib import Path
 from typing import TYPE_CHECKING
 
 from argx import REMAINDER
 from pipen.cli import AsyncCLIPlugin
 
-from .require import PipenRequire
+from .history import DEFAULT_HISTORY_DB
+from .require import DEFAULT_MAX_OUTPUT, PipenRequire
 from .version import __version__
 
 if TYPE_CHECKING:  # pragma: no cover
     from argx import ArgumentParser, Namespace
 
 
+def _ncores(value: str) -> int | str:
+    """Parse the value of --ncores, either "auto" or a positive integer"""
+    if value == "auto":
+        return value
+    try:
+        ncores = int(value)
+    except ValueError:
+        ncores = 0
+    if ncores < 1:
+        raise ArgumentTypeError(
+            f"must be a positive integer or 'auto', got {value!r}"
+        )
+    return ncores
+
+
+def _positive_int(value: str) -> int:
+    """Parse a positive integer"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise ArgumentTypeError(f"must be a positive integer, got {value!r}")
+    return number
+
+
+def _size(value: str) -> int:
+    """Parse a positive size in bytes, with an optional unit (K, M, G or T)"""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    size = value.strip().upper().rstrip("B")
+    try:
+        if size and size[-1] in units:
+            size = int(float(size[:-1]) * units[size[-1]])
+        else:
+            size = int(size)
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise ArgumentTypeError(
+            f"must be a positive size, e.g. 512M or 4G, got {value!r}"
+        )
+    return size
+
+
 class PipenCliRequirePlugin(AsyncCLIPlugin):
     """Check the requirements of a pipeline"""
 
@@ -29,10 +76,16 @@ class PipenCliRequirePlugin(AsyncCLIPlugin):
         subparser.exit_on_void = True
         subparser.add_argument(
             "--ncores",
-            type=int,
+            type=_ncores,
             default=1,
             dest="ncores",
-            help="Number of cores to use to check the requirements",
+            help=(
+                "Number of cores to use to check the requirements. "
+                "Use `auto` to adapt the number of checks running at the same "
+                "time to the load, the free memory and the CPU profile of "
+                "the checks. The `weight` of a requirement (default: 1) counts "
+                "against the number of cores"
+            ),
         )
         subparser.add_argument(
             "--verbose",
@@ -41,6 +94,119 @@ class PipenCliRequirePlugin(AsyncCLIPlugin):
             dest="verbose",
             help="Show verbosal error when checking failed",
         )
+        subparser.add_argument(
+            "--max-output",
+            type=_positive_int,
+            default=DEFAULT_MAX_OUTPUT // 1024,
+            dest="max_output",
+            help=(
+                "Only keep the last N KB of the output of each check to "
+                "show as the error"
+            ),
+        )
+        subparser.add_argument(
+            "--logdir",
+            default=None,
+            dest="logdir",
+            help=(
+                "A directory to save the full output of each check, "
+                "one file per check"
+            ),
+        )
+        subparser.add_argument(
+            "--max-memory",
+            type=_size,
+            default=None,
+            dest="max_memory",
+            help=(
+                "The max memory (address space) of each check, "
+                "e.g. `4G`. Checks exceeding it fail to allocate memory"
+            ),
+        )
+        subparser.add_argument(
+            "--max-cputime",
+            type=_positive_int,
+            default=None,
+            dest="max_cputime",
+            help="The max CPU time (in seconds) of each check",
+        )
+        subparser.add_argument(
+            "--max-files",
+            type=_positive_int,
+            default=None,
+            dest="max_files",
+            help="The max number of open files of each check",
+        )
+        subparser.add_argument(
+            "--export",
+            default=None,
+            dest="export",
+            help=(
+                "Export the rendered checks and their results, with the "
+                "fingerprints of the environment and the checks, to a JSON "
+                "snapshot"
+            ),
+        )
+        subparser.add_argument(
+            "--verify-snapshot",
+            default=None,
+            dest="snapshot",
+            help=(
+                "Verify the environment against a snapshot exported by "
+                "`--export`. When the environment fingerprint matches, the "
+                "successes of the checks whose inputs are unchanged are reused "
+                "and only the other checks are run; otherwise all the checks "
+                "are run. The failed checks are always run again"
+            ),
+        )
+        subparser.add_argument(
+            "--reuse-env",
+            action="store_true",
+            default=False,
+            dest="reuse_env",
+            help=(
+                "Group the checks by their environment wrappers "
+                "(e.g. `conda run -n env`, `singularity exec img.sif`) and run "
+                "each group in a single shell started inside the environment, "
+                "so that the environment is activated only once"
+            ),
+        )
+        subparser.add_argument(
+            "--fold-setup",
+            action="store_true",
+            default=False,
+            dest="fold_setup",
+            help=(
+                "Fold the checks sharing a setup prefix "
+                "(e.g. `source activate env && ...`) into a single shell, "
+                "so that the setup runs only once. "
+                "The folded checks run one after another"
+            ),
+        )
+        subparser.add_argument(
+            "--history",
+            action="store_true",
+            default=False,
+            dest="history",
+            help=(
+                "Show the history of the checks of the pipeline (flaky checks, "
+                "duration regressions and failing streaks) instead of "
+                "checking the requirements"
+            ),
+        )
+        subparser.add_argument(
+            "--history-db",
+            default=DEFAULT_HISTORY_DB,
+            dest="history_db",
+            help="The SQLite database to keep the results of the checks",
+        )
+        subparser.add_argument(
+            "--no-history",
+            action="store_true",
+            default=False,
+            dest="no_history",
+            help="Do not record the results of the checks in the history",
+        )
         subparser.add_argument(
             "-p",
             "--pipeline",
@@ -66,12 +232,32 @@ class PipenCliRequirePlugin(AsyncCLIPlugin):
 
     async def exec_command(self, args: Namespace) -> None:
         """Execute the command"""
-        await PipenRequire(
+        require = PipenRequire(
             args.pipeline,
             args.pipeline_args,
             args.ncores,
             args.verbose,
-        ).run()
+            max_output=args.max_output * 1024,
+            logdir=args.logdir,
+            reuse_env=args.reuse_env,
+            fold_setup=args.fold_setup,
+            history_db=(
+                None
+                if args.no_history and not args.history
+                else args.history_db
+            ),
+            limits={
+                "memory": args.max_memory,
+                "cputime": args.max_cputime,
+                "files": args.max_files,
+            },
+            export=args.export,
+            snapshot=args.snapshot,
+        )
+        if args.history:
+            await require.history()
+        else:
+            await require.run()
 
     async def parse_args(
         self,
@@ -82,6 +268,14 @@ class PipenCliRequirePlugin(AsyncCLIPlugin):
         if unparsed_argv:
             self.subparser.parse_args()
 
+        if (
+            known_parsed.snapshot is not None
+            and not Path(known_parsed.snapshot).is_file()
+        ):
+            self.subparser.error(
+                f"argument --verify-snapshot: no such file: {known_parsed.snapshot}"
+            )
+
         if known_parsed.pipeline_args:
             known_parsed.pipeline_args = known_parsed.pipeline_args[1:]
 
@@ -0,0 +1,97 @@
+"""Provides fingerprints of the environment the checks run in"""
+from __future__ import annotations
+
+import os
+import platform
+import shlex
+import shutil
+import sys
+from hashlib import sha256
+
+# The environment variables that affect what the checks find
+FINGERPRINT_ENVS = (
+    "PATH",
+    "LD_LIBRARY_PATH",
+    "PYTHONPATH",
+    "R_LIBS",
+    "R_LIBS_USER",
+    "CONDA_PREFIX",
+    "VIRTUAL_ENV",
+)
+
+
+def _digest(parts) -> str:
+    """Get a compact digest of the parts"""
+    return sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def environment_fingerprint() -> str:
+    """Get a compact fingerprint of the environment
+
+    It covers the platform, the python running the checks and the environment
+    variables that affect where the tools and libraries are found.
+
+    Returns:
+        A 16-character hex digest
+    """
+    return _digest(
+        [
+            platform.system(),
+            platform.machine(),
+            sys.executable,
+            sys.version,
+            *(f"{name}={os.environ.get(name, '')}" for name in FINGERPRINT_ENVS),
+        ]
+    )
+
+
+def _file_signature(path: str) -> str:
+    """Get the signature of a file, changed when the file is replaced"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return f"{path}:missing"
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def check_fingerprint(check: str) -> str:
+    """Get a compact fingerprint of the inputs of a check
+
+    It covers the check itself, the environment variables that affect where
+    the libraries are found, and the executables and files used by the check
+    (resolved from PATH for the commands), which change when the tools are
+    installed, upgraded or removed.
+
+    Args:
+        check: The rendered check
+
+    Returns:
+        A 16-character hex digest
+    """
+    try:
+        tokens = shlex.split(check)
+    except ValueError:
+        tokens = check.split()
+
+    files = []
+    for token in tokens:
+        if "/" in token:
+            if os.path.exists(token):
+                files.append(_file_signature(os.path.abspath(token)))
+            continue
+        executable = shutil.which(token)
+        if executable is not None:
+            files.append(_file_signature(os.path.realpath(executable)))
+
+    return _digest(
+        [
+            check,
+            *(
+                f"{name}={os.environ.get(name, '')}"
+                for name in FINGERPRINT_ENVS
+                # The executables are resolved from PATH instead
+                if name != "PATH"
+            ),
+            *files,
+        ]
+    )
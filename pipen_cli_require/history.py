@@ -0,0 +1,221 @@
+"""Provides the HistoryStore to keep the results of the checks across runs"""
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from statistics import median
+from typing import Iterable, List, Mapping, Tuple
+
+from diot import Diot
+
+DEFAULT_HISTORY_DB = "~/.pipen-cli-require/history.db"
+# The number of recent runs to report and to estimate the durations
+DEFAULT_HISTORY_RUNS = 20
+# A duration is a regression if it is so many times the median of the previous
+REGRESSION_FACTOR = 2.0
+# Ignore regressions of the checks faster than this (seconds)
+REGRESSION_MIN_DURATION = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    run REAL NOT NULL,
+    pipeline TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL,
+    fingerprint TEXT NOT NULL,
+    max_rss INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_pipeline_run ON records (pipeline, run);
+CREATE INDEX IF NOT EXISTS records_pipeline_key ON records (pipeline, key, run);
+"""
+
+
+class HistoryStore:
+    """A SQLite store of the results of the checks
+
+    Each run appends one record per check, with the pipeline, the key
+    (`<proc>/<requirement>`), the status, the duration, the environment
+    fingerprint and the max resident set size. The run is identified by its
+    start time.
+
+    Args:
+        path: The path to the database file
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.row_factory = sqlite3.Row
+        # Allow other runs (e.g. CI jobs) to read while one is writing
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(records)")]
+        # Databases created before max_rss was recorded
+        if "max_rss" not in columns:  # pragma: no cover
+            self.conn.execute("ALTER TABLE records ADD COLUMN max_rss INTEGER")
+
+    def close(self):
+        """Close the database"""
+        self.conn.close()
+
+    def record(
+        self,
+        run: float,
+        pipeline: str,
+        fingerprint: str,
+        records: Iterable[Tuple[str, str, float | None, int | None]],
+    ):
+        """Append the records of a run
+
+        Args:
+            run: The start time of the run
+            pipeline: The name of the pipeline
+            fingerprint: The environment fingerprint
+            records: The (key, status, duration, max_rss) of the checks
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO records "
+                "(run, pipeline, key, status, duration, fingerprint, max_rss) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run, pipeline, key, status, duration, fingerprint, max_rss)
+                    for key, status, duration, max_rss in records
+                ],
+            )
+
+    def _recent(self, pipeline: str, runs: int) -> List[sqlite3.Row]:
+        """Get the records of the recent runs, oldest first"""
+        return self.conn.execute(
+            """
+            SELECT * FROM records
+            WHERE pipeline = ? AND run >= (
+                SELECT COALESCE(MIN(run), 0) FROM (
+                    SELECT DISTINCT run FROM records
+                    WHERE pipeline = ?
+                    ORDER BY run DESC
+                    LIMIT ?
+                )
+            )
+            ORDER BY run
+            """,
+            (pipeline, pipeline, runs),
+        ).fetchall()
+
+    def durations(
+        self,
+        pipeline: str,
+        runs: int = DEFAULT_HISTORY_RUNS,
+    ) -> Mapping[str, float]:
+        """Get the expected (median) durations of the checks
+
+        Args:
+            pipeline: The name of the pipeline
+            runs: The number of recent runs to use
+
+        Returns:
+            A dict of key => median duration
+        """
+        durations = {}
+        for row in self._recent(pipeline, runs):
+            if row["duration"] is not None:
+                durations.setdefault(row["key"], []).append(row["duration"])
+        return {key: median(durs) for key, durs in durations.items()}
+
+    def max_rss(
+        self,
+        pipeline: str,
+        runs: int = DEFAULT_HISTORY_RUNS,
+    ) -> Mapping[str, int]:
+        """Get the max resident set sizes of the checks
+
+        Args:
+            pipeline: The name of the pipeline
+            runs: The number of recent runs to use
+
+        Returns:
+            A dict of key => max rss in bytes
+        """
+        max_rss = {}
+        for row in self._recent(pipeline, runs):
+            if row["max_rss"] is not None:
+                max_rss[row["key"]] = max(max_rss.get(row["key"], 0), row["max_rss"])
+        return max_rss
+
+    def report(
+        self,
+        pipeline: str,
+        runs: int = DEFAULT_HISTORY_RUNS,
+    ) -> List[Diot]:
+        """Summarize the recent runs of the checks
+
+        Args:
+            pipeline: The name of the pipeline
+            runs: The number of recent runs to summarize
+
+        Returns:
+            A list of summaries, one for each check, sorted by the key, with
+            - key: The key of the check
+            - runs: The number of runs of the check
+            - failures: The number of failed runs
+            - flips: The number of times the status changed between runs,
+                ignoring the runs skipped by the if-statement
+            - status: The last status
+            - failing_since: The start of the current failing streak,
+                ignoring the runs skipped by the if-statement
+            - duration: The last duration
+            - median: The median duration of the previous runs
+            - regression: Whether the last duration is a regression
+            - max_rss: The max resident set size over the runs
+        """
+        history = {}
+        for row in self._recent(pipeline, runs):
+            history.setdefault(row["key"], []).append(row)
+
+        out = []
+        for key in sorted(history):
+            rows = history[key]
+            # The runs skipped by the if-statement did not run the check
+            statuses = [
+                row["status"] for row in rows if row["status"] != "if_skipping"
+            ]
+            failing_since = None
+            for row in reversed(rows):
+                if row["status"] == "if_skipping":
+                    continue
+                if row["status"] != "error":
+                    break
+                failing_since = row["run"]
+
+            duration = rows[-1]["duration"]
+            previous = [
+                row["duration"] for row in rows[:-1] if row["duration"] is not None
+            ]
+            med = median(previous) if previous else None
+            out.append(
+                Diot(
+                    key=key,
+                    runs=len(rows),
+                    failures=statuses.count("error"),
+                    flips=sum(
+                        prev != curr for prev, curr in zip(statuses, statuses[1:])
+                    ),
+                    status=rows[-1]["status"],
+                    failing_since=failing_since,
+                    duration=duration,
+                    median=med,
+                    regression=(
+                        duration is not None
+                        and med is not None
+                        and duration >= REGRESSION_MIN_DURATION
+                        and duration > med * REGRESSION_FACTOR
+                    ),
+                    max_rss=max(
+                        (row["max_rss"] for row in rows if row["max_rss"] is not None),
+                        default=None,
+                    ),
+                )
+            )
+        return out
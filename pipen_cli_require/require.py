@@ -1,29 +1,121 @@
 """Provides the PipenRequire class"""
 from __future__ import annotations
 
+import os
+import re
+import resource
+import shlex
+import signal
+import sqlite3
 import sys
+from collections import deque
+from datetime import datetime
 from enum import Enum, auto
-from multiprocessing import Pool, Manager
-from subprocess import PIPE, run
-from time import sleep
-from typing import List, Mapping, Tuple, Type
+from functools import lru_cache
+from multiprocessing import Pool, Manager, get_context
+from pathlib import Path
+from subprocess import DEVNULL, PIPE, STDOUT, CalledProcessError, Popen
+from tempfile import TemporaryFile
+from threading import RLock, Thread
+from time import monotonic, sleep, time
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+    Type,
+)
 
 from diot import Diot, OrderedDiot
+from rich.console import Console
+from rich.table import Table
 from rich.tree import Tree
 from rich.live import Live
 from rich.status import Status
 from liquid import Liquid
 from pipen import Proc
-from pipen.utils import load_pipeline
+from pipen.utils import get_marked, load_pipeline
 from pipen_annotate import annotate
 
+from .fingerprint import environment_fingerprint
+from .history import HistoryStore
+from .scheduler import AdaptiveLimiter
+from .snapshot import load_snapshot, reusable_results, save_snapshot
+
 PROC_SUMMARY_NAME = "_SUMMARY"
+# Keep only the last so many bytes of the output of a check
+DEFAULT_MAX_OUTPUT = 64 * 1024
+# The chunk size to read the output of a check
+READ_CHUNK_SIZE = 8192
+# The marker printed by the session shell after each check: <marker> <i> <rc>
+SESSION_MARKER = "__PIPEN_REQUIRE_CHECK_DONE__"
+# The wrappers to run commands inside an environment or a container:
+# (command, subcommand) => (options taking a value, flags, taking an image)
+# A check using an option not listed here is not grouped by --reuse-env,
+# since it is unknown whether the option takes a value.
+_CONDA_RUN = (
+    {"-n", "--name", "-p", "--prefix", "--cwd"},
+    {"--no-capture-output", "--live-stream", "-v", "--verbose", "--dev"},
+    False,
+)
+_SINGULARITY_EXEC = (
+    {
+        "-B", "--bind", "--env", "--env-file", "-W", "--workdir", "--pwd",
+        "-H", "--home", "-o", "--overlay", "--network", "--network-args",
+        "-S", "--scratch", "--security", "--mount", "--app", "--hostname",
+        "--dns", "--apply-cgroups", "--no-mount",
+    },
+    {
+        "-e", "--cleanenv", "-c", "--contain", "-C", "--containall", "--nv",
+        "--rocm", "-w", "--writable", "--writable-tmpfs", "--no-home",
+        "-f", "--fakeroot", "-u", "--userns", "--compat", "-i", "--ipc",
+        "-p", "--pid", "--no-init", "--no-privs",
+    },
+    True,
+)
+ENV_WRAPPERS = {
+    ("conda", "run"): _CONDA_RUN,
+    ("mamba", "run"): _CONDA_RUN,
+    ("micromamba", "run"): _CONDA_RUN,
+    ("singularity", "exec"): _SINGULARITY_EXEC,
+    ("apptainer", "exec"): _SINGULARITY_EXEC,
+}
+# Parse the requirements of the processes in parallel only when there are
+# at least so many processes, otherwise forking costs more than it saves
+PARALLEL_PARSE_MIN_PROCS = 64
+# The min number of processes parsed by each forked worker
+PARSE_PROCS_PER_WORKER = 16
+# The setup commands that the checks share as a prefix: <setup> && <check>
+SETUP_PREFIX_PATTERN = re.compile(
+    r"^\s*((?:source\s|\.\s|(?:conda|mamba|micromamba)\s+activate\s"
+    r"|module\s+load\s|ml\s|spack\s+load\s|export\s)[^&|;\n]*?)\s*&&\s*"
+)
+# The control operators after the setup prefix that make folding unsafe,
+# since the check does not fail with the setup any more
+# (e.g. `source env.sh && false || true`)
+UNSAFE_SETUP_OPERATORS = ("||", ";", "&", "|&")
+# The control operators after the environment wrapper that make grouping
+# unsafe, since the commands after them run outside of the environment
+# (e.g. `conda run -n env python -c "import x" && python -c "import y"`)
+UNSAFE_WRAPPER_OPERATORS = ("&&", "||", ";", ";;", "&", "|", "|&")
+CONTROL_OPERATOR_PATTERN = re.compile(r"\|\||&&|;;|\|&|[;&|]")
+# The resources that can be limited for the checks
+RLIMITS = {
+    "memory": resource.RLIMIT_AS,
+    "cputime": resource.RLIMIT_CPU,
+    "files": resource.RLIMIT_NOFILE,
+}
 # Cache the status of the checks: check => status
 # When status is SUCESS, then the check is successful
 # Otherwise, it is the error
 STATUSES = Manager().dict()
 
 annotate.register_section("Requires", "Items")
+# The processes to parse by the forked workers, see _parse_requirements
+_PROCS_TO_PARSE: Sequence[Type[Proc]] = ()
 
 
 class CheckingStatus(Enum):
@@ -37,13 +129,28 @@ class CheckingStatus(Enum):
     IF_SKIPPING = auto()
 
 
+@lru_cache(maxsize=None)
+def _compile_requirement(s: str) -> Liquid:
+    """Compile a requirement template, which is shared by the processes
+    with the same docstring"""
+    return Liquid(s, from_file=False, mode="wild")
+
+
 def _render_requirement(s: str | None, proc: Type[Proc]) -> str | None:
     """Render a requirement"""
     if s is None:
         return None
 
-    liq = Liquid(s, from_file=False, mode="wild")
-    return liq.render(proc=proc, envs=proc.envs)
+    # Nothing to render, the trailing newline would be stripped by rendering
+    if "{" not in s and not s.endswith("\n"):
+        return s
+
+    return _compile_requirement(s).render(proc=proc, envs=proc.envs)
+
+
+def _is_true(s: str | None) -> bool:
+    """Check if a rendered term is true"""
+    return s is not None and s.strip().lower() in ("true", "1")
 
 
 def parse_proc_requirements(
@@ -58,14 +165,36 @@ def parse_proc_requirements(
         A tuple of two OrderedDiot's.
         The first one is the annotated sections by pipen_annotate
         The second one is the requirements. The key is the name of the
-            requirement, the value is a dict with message, check and if_ keys.
+            requirement, the value is a dict with message, check, if_,
+            stdout and weight keys.
     """
     annotated = annotate(proc)
+    return annotated, _requirements_from_annotated(annotated, proc)
+
+
+def _weight(value: str, proc: Type[Proc], key: str) -> float:
+    """Parse the weight of a requirement, which must be a positive number"""
+    try:
+        weight = float(value)
+    except ValueError:
+        weight = None
+    if weight is None or not weight > 0 or weight == float("inf"):
+        raise ValueError(
+            f"[{proc.name}] Invalid weight of requirement {key!r}: {value!r}, "
+            "expecting a positive number"
+        )
+    return weight
+
 
+def _requirements_from_annotated(
+    annotated: OrderedDiot,
+    proc: Type[Proc],
+) -> OrderedDiot:
+    """Render the requirements of a process from its annotation"""
     out = OrderedDiot()
     # No requirements specified
     if "Requires" not in annotated:
-        return annotated, out
+        return out
 
     for key, val in annotated.Requires.items():
         out[key] = Diot(
@@ -82,27 +211,520 @@ def parse_proc_requirements(
                 else val.terms["if"].help,
                 proc,
             ),
+            stdout=_is_true(
+                _render_requirement(
+                    None
+                    if "stdout" not in val.terms
+                    else val.terms.stdout.help,
+                    proc,
+                )
+            ),
+            weight=_weight(
+                _render_requirement(
+                    "1"
+                    if "weight" not in val.terms
+                    else val.terms.weight.help,
+                    proc,
+                ),
+                proc,
+                key,
+            ),
         )
 
-    return annotated, out
+    return out
+
+
+def _annotation_key(proc: Type[Proc]) -> Tuple:
+    """Get the key of the processes sharing the same Summary and Requires
+    annotations, which only depend on the docstrings along the MRO"""
+    return tuple(
+        (cls.__doc__, get_marked(cls, "annotate_inherit", True))
+        for cls in proc.__mro__
+    )
 
 
-def _run_check(pname, name, cond, check, status, errors):
-    """Run a check"""
-    status[f"{pname}/{name}"] = CheckingStatus.CHECKING
-    if cond.lower() not in ("true", "1"):
-        status[f"{pname}/{name}"] = CheckingStatus.IF_SKIPPING
+def _parse_requirements_chunk(
+    indexes: Sequence[int],
+) -> List[Tuple[str, str, OrderedDiot]]:
+    """Parse the requirements of a chunk of the processes
+
+    The docstrings are annotated only once for the processes sharing them
+    (e.g. created by `Proc.from_proc()`), only the rendering is per process.
+
+    Args:
+        indexes: The indexes of the processes in _PROCS_TO_PARSE
+
+    Returns:
+        A list of (name, summary, requirements) of the processes
+    """
+    annotations = {}
+    out = []
+    for i in indexes:
+        proc = _PROCS_TO_PARSE[i]
+        key = _annotation_key(proc)
+        if key not in annotations:
+            annotations[key] = annotate(proc)
+        anno = annotations[key]
+        out.append(
+            (
+                proc.name,
+                anno.Summary.short,
+                _requirements_from_annotated(anno, proc),
+            )
+        )
+    return out
+
+
+def _parse_requirements(
+    procs: Sequence[Type[Proc]],
+    ncores: int = 1,
+) -> OrderedDiot:
+    """Parse the requirements of the processes of a pipeline
+
+    The processes are parsed in forked workers when there are many of them,
+    as annotating and rendering are CPU-bound. The processes are inherited
+    by the workers through fork, since they are not always picklable
+    (e.g. created by `Proc.from_proc()` or modified by the CLI arguments).
+
+    Args:
+        procs: The processes
+        ncores: The number of workers to use
+
+    Returns:
+        The requirements of the processes, in the order of the processes,
+        each with the summary of the process under PROC_SUMMARY_NAME
+    """
+    global _PROCS_TO_PARSE
+
+    # Do not fork more workers than there are chunks worth forking for
+    ncores = min(ncores, len(procs) // PARSE_PROCS_PER_WORKER)
+    ctx = None
+    if ncores > 1 and len(procs) >= PARALLEL_PARSE_MIN_PROCS:
+        try:
+            ctx = get_context("fork")
+        except ValueError:  # pragma: no cover
+            pass
+
+    _PROCS_TO_PARSE = procs
+    try:
+        if ctx is None:
+            parsed = _parse_requirements_chunk(range(len(procs)))
+        else:
+            # Contiguous chunks, so that the processes sharing docstrings
+            # (usually defined next to each other) are mostly in the same chunk
+            chunksize = -(-len(procs) // (ncores * 4))
+            chunks = [
+                range(start, min(start + chunksize, len(procs)))
+                for start in range(0, len(procs), chunksize)
+            ]
+            with ctx.Pool(processes=ncores) as pool:
+                parsed = [
+                    item
+                    for chunk in pool.map(_parse_requirements_chunk, chunks)
+                    for item in chunk
+                ]
+    finally:
+        _PROCS_TO_PARSE = ()
+
+    all_reqs = OrderedDiot()
+    for name, summary, requires in parsed:
+        all_reqs[name] = requires
+        all_reqs[name][PROC_SUMMARY_NAME] = summary
+    return all_reqs
+
+
+def _has_control_operators(command: str, operators: Sequence[str]) -> bool:
+    """Check if a command has any of the control operators at the top level
+
+    Args:
+        command: The command
+        operators: The control operators to look for
+
+    Returns:
+        True if any of the operators or a newline is found, or the command
+        cannot be tokenized
+    """
+    command = command.strip()
+    if "\n" in command:
+        return True
+
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return True
+
+    punctuation = set(lexer.punctuation_chars)
+    for token in tokens:
+        # Skip the words and the redirections (e.g. `2>&1`)
+        if not set(token) <= punctuation or "<" in token or ">" in token:
+            continue
+        if any(
+            operator in operators
+            for operator in CONTROL_OPERATOR_PATTERN.findall(token)
+        ):
+            return True
+    return False
+
+
+def _split_env_wrapper(check: str) -> Tuple[str | None, str]:
+    """Split the environment wrapper from a check
+
+    For example, `conda run -n env python -c "import x"` is split into
+    `conda run --no-capture-output -n env` and `python -c "import x"`.
+    `--no-capture-output` is added to `conda run` (and alike) so that the
+    output of the session shell is not buffered until it exits.
+
+    The check is not split (None is returned as the wrapper) when it is
+    ambiguous, i.e. the wrapper has an unknown option or quoted tokens, or
+    when the rest of the check has a top-level control operator (e.g. `&&`
+    or `|`), where the following commands would run in the environment.
+
+    Args:
+        check: The rendered check
+
+    Returns:
+        The wrapper (None if not detected) and the rest of the check
+    """
+    tokens = []
+    pos = 0
+
+    def _next_token():
+        nonlocal pos
+        matched = re.compile(r"\s*(\S+)").match(check, pos)
+        if not matched:
+            return None
+        pos = matched.end()
+        return matched.group(1)
+
+    command, subcommand = _next_token(), _next_token()
+    if (command, subcommand) not in ENV_WRAPPERS:
+        return None, check
+
+    value_options, flags, image = ENV_WRAPPERS[(command, subcommand)]
+    conda = not image
+    while True:
+        body_start = pos
+        token = _next_token()
+        if token is None:
+            return None, check
+        if any(char in token for char in "'\"\\$`"):
+            return None, check
+        if not token.startswith("-"):
+            break
+        option = token.split("=", 1)[0]
+        if option in value_options:
+            if "=" not in token:
+                value = _next_token()
+                if value is None or any(char in value for char in "'\"\\$`"):
+                    return None, check
+                token = f"{token} {value}"
+        elif token not in flags:
+            return None, check
+        if conda and token in ("--no-capture-output", "--live-stream"):
+            continue
+        tokens.append(token)
+
+    if image:
+        # The token is the image, the body starts after it
+        tokens.append(token)
+        body_start = pos
+    elif not tokens:
+        # Not running in a specific environment
+        return None, check
+    else:
+        tokens.insert(0, "--no-capture-output")
+
+    body = check[body_start:].lstrip()
+    if not body.strip() or _has_control_operators(body, UNSAFE_WRAPPER_OPERATORS):
+        return None, check
+    return " ".join([command, subcommand, *tokens]), body
+
+
+def _split_setup_prefix(check: str) -> Tuple[str | None, str]:
+    """Split the setup prefix from a check
+
+    For example, `source activate env && python -c "import x"` is split into
+    `source activate env` and `python -c "import x"`.
+
+    The check is not split when the prefix cannot be tokenized (e.g. a
+    `&&` inside quotes) or when the rest of the check has a top-level `||`,
+    `;` or `&`, where the check would not fail with the setup any more.
+
+    Args:
+        check: The check (with the environment wrapper stripped)
+
+    Returns:
+        The setup prefix (None if not detected) and the rest of the check
+    """
+    matched = SETUP_PREFIX_PATTERN.match(check)
+    if not matched:
+        return None, check
+
+    setup, body = matched.group(1).strip(), check[matched.end():]
+    try:
+        shlex.split(setup)
+    except ValueError:
+        return None, check
+    if _has_control_operators(body, UNSAFE_SETUP_OPERATORS):
+        return None, check
+    return setup, body
+
+
+def _log_file(logdir: str | Path | None, pname: str, name: str) -> Path | None:
+    """Get the path of the log file of a check"""
+    if logdir is None:
+        return None
+    return Path(logdir) / f"{pname}.{name}.log"
+
+
+def _limit_resources(limits: Mapping[str, int] | None) -> Callable | None:
+    """Get the function to limit the resources of a check in the child process
+
+    Only the soft limits are lowered, never above the hard limits.
+
+    Args:
+        limits: The limits, with memory (bytes of address space),
+            cputime (seconds) and files (number of open files).
+            A limit of None means unlimited.
+
+    Returns:
+        The function to pass as `preexec_fn`, or None if no limits
+    """
+    if not limits:
+        return None
+
+    rlimits = [
+        (RLIMITS[name], value)
+        for name, value in limits.items()
+        if value is not None
+    ]
+    if not rlimits:
+        return None
+
+    def preexec():
+        for res, value in rlimits:
+            _, hard = resource.getrlimit(res)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(res, (value, hard))
+
+    return preexec
+
+
+def _run_command(
+    cmd: List[str],
+    stdout: bool = False,
+    max_output: int = DEFAULT_MAX_OUTPUT,
+    logfile: str | Path | None = None,
+    limits: Mapping[str, int] | None = None,
+) -> Tuple[int, str, Diot]:
+    """Run a command, keeping only the tail of its output
+
+    Args:
+        cmd: The command to run
+        stdout: Whether to capture stdout (merged into stderr).
+            If False, stdout is discarded, or written to the log file only.
+        max_output: Keep only the last so many bytes of the captured output
+        logfile: If given, the full output is streamed to this file
+        limits: The resource limits of the command, see _limit_resources
+
+    Returns:
+        The return code, the tail of the captured output and the resource
+        usage of the command
+    """
+    logfh = None
+    if logfile is not None:
+        Path(logfile).parent.mkdir(parents=True, exist_ok=True)
+        logfh = open(logfile, "wb", buffering=0)
+
+    preexec = _limit_resources(limits)
+    start = monotonic()
+    try:
+        if stdout:
+            p = Popen(cmd, stdout=PIPE, stderr=STDOUT, preexec_fn=preexec)
+            stream = p.stdout
+        else:
+            p = Popen(
+                cmd,
+                stdout=logfh or DEVNULL,
+                stderr=PIPE,
+                preexec_fn=preexec,
+            )
+            stream = p.stderr
+
+        # A ring buffer with the last max_output bytes of the output
+        buf = bytearray()
+        truncated = False
+        for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+            if logfh is not None:
+                logfh.write(chunk)
+            buf += chunk
+            if len(buf) > max_output:
+                del buf[: len(buf) - max_output]
+                truncated = True
+        stream.close()
+        usage = _wait(p, start)
+    finally:
+        if logfh is not None:
+            logfh.close()
+
+    output = _format_output(buf, truncated, max_output)
+    if p.returncode < 0:
+        # Killed by a signal, e.g. SIGXCPU when exceeding the CPU time limit
+        output += f"\n[Killed by {signal.Signals(-p.returncode).name}]"
+    return p.returncode, output, usage
+
+
+def _wait(p: Popen, start: float) -> Diot:
+    """Wait for a process and get its resource usage
+
+    On Linux, a child inherits the peak memory usage of the process forking it,
+    so the max resident set size of a child is only known when it exceeds the
+    peak of this process.
+
+    Args:
+        p: The process
+        start: The monotonic time when the process started
+
+    Returns:
+        The resource usage, with wall and cpu (user + system) time in seconds,
+        and the max resident set size (maxrss) in bytes, including the
+        descendants of the process, or None if not known
+    """
+    _, waitstatus, rusage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(waitstatus)
+    maxrss = rusage.ru_maxrss
+    if maxrss <= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+        maxrss = None
+    else:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss *= 1 if sys.platform == "darwin" else 1024
+    return Diot(
+        wall=monotonic() - start,
+        cpu=rusage.ru_utime + rusage.ru_stime,
+        maxrss=maxrss,
+    )
+
+
+def _format_bytes(nbytes: float) -> str:
+    """Format a number of bytes to be human-readable"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+def _format_usage(usage: Mapping[str, float]) -> str:
+    """Format the resource usage of a check"""
+    out = f"{usage['wall']:.2f}s"
+    if usage.get("cpu") is not None:
+        out += f", cpu {usage['cpu']:.2f}s"
+    if usage.get("maxrss") is not None:
+        out += f", max rss {_format_bytes(usage['maxrss'])}"
+    return out
+
+
+def _format_output(buf: bytes, truncated: bool, max_output: int) -> str:
+    """Decode the captured output, marking it if truncated"""
+    output = buf.decode("utf-8", errors="replace")
+    if truncated:
+        output = f"[... truncated to the last {max_output} bytes]\n{output}"
+    return output
+
+
+def _read_tail(fh: BinaryIO, max_output: int = DEFAULT_MAX_OUTPUT) -> str:
+    """Read the last max_output bytes of a file object"""
+    size = fh.seek(0, 2)
+    fh.seek(max(0, size - max_output))
+    return _format_output(fh.read(), size > max_output, max_output)
+
+
+def _read_payload(
+    stream: BinaryIO,
+    nbytes: int,
+    max_output: int = DEFAULT_MAX_OUTPUT,
+    logfh: BinaryIO | None = None,
+) -> str:
+    """Read so many bytes from a stream, keeping only the tail
+
+    Args:
+        stream: The stream to read from
+        nbytes: The number of bytes to read
+        max_output: Keep only the last so many bytes
+        logfh: If given, the bytes are also written to this file object
+
+    Returns:
+        The tail of the bytes read
+    """
+    buf = bytearray()
+    truncated = False
+    while nbytes > 0:
+        chunk = stream.read(min(nbytes, READ_CHUNK_SIZE))
+        if not chunk:
+            break
+        nbytes -= len(chunk)
+        if logfh is not None:
+            logfh.write(chunk)
+        buf += chunk
+        if len(buf) > max_output:
+            del buf[: len(buf) - max_output]
+            truncated = True
+    return _format_output(buf, truncated, max_output)
+
+
+def _run_check(
+    pname,
+    name,
+    cond,
+    check,
+    status,
+    errors,
+    stdout=False,
+    max_output=DEFAULT_MAX_OUTPUT,
+    logfile=None,
+    aliases=(),
+    limits=None,
+):
+    """Run a check
+
+    The aliases are the other requirements (`<proc>/<requirement>`) with the
+    same check, which share the result of this one. The limits are the
+    resource limits of the check, see _limit_resources.
+
+    Returns:
+        The resource usage of the check, or None if it was not run by this call.
+        When the check fails, the usage is attached to the error.
+    """
+    keys = [f"{pname}/{name}", *aliases]
+    for key in keys:
+        status[key] = CheckingStatus.CHECKING
+    if not _is_true(cond):
+        for key in keys:
+            status[key] = CheckingStatus.IF_SKIPPING
         return
 
     if check not in STATUSES:
         STATUSES[check] = CheckingStatus.CHECKING.value
         cmd = ["/usr/bin/env", "bash", "-c", check]
-        p = run(cmd, stdout=PIPE, stderr=PIPE)
-        if p.returncode != 0:
-            error = p.stderr.decode("utf-8")
-            STATUSES[check] = errors[f"{pname}/{name}"] = error
-        p.check_returncode()
+        returncode, output, usage = _run_command(
+            cmd,
+            stdout,
+            max_output,
+            logfile,
+            limits,
+        )
+        if returncode != 0:
+            STATUSES[check] = output
+            for key in keys:
+                errors[key] = output
+            error = CalledProcessError(returncode, cmd)
+            error.usage = usage
+            raise error
         STATUSES[check] = CheckingStatus.SUCCESS.value
+        return usage
     else:
         # Wait for the check to finish
         while STATUSES[check] in (
@@ -112,30 +734,234 @@ def _run_check(pname, name, cond, check, status, errors):
             sleep(0.1)
 
         if STATUSES[check] != CheckingStatus.SUCCESS.value:
-            errors[f"{pname}/{name}"] = STATUSES[check]
+            for key in keys:
+                errors[key] = STATUSES[check]
             raise RuntimeError(STATUSES[check])
         else:
             STATUSES[check] = CheckingStatus.SUCCESS.value
 
 
+def _run_session(
+    wrapper,
+    setup,
+    items,
+    status,
+    errors,
+    max_output=DEFAULT_MAX_OUTPUT,
+    limits=None,
+):
+    """Run checks in a single shell started inside an environment
+
+    The environment (e.g. `conda run -n env`) is activated and the setup
+    (e.g. `source activate env`) is run only once, and the checks, with the
+    wrapper and the setup stripped, are run by that shell one after another,
+    each in a subshell. The shell prints a marker with the exit code after
+    each check, followed by the output of the check. If the setup fails, all
+    the checks fail. `bash` is required inside the environment.
+
+    When a log file is given, stdout and stderr of the check are written to
+    it one after another instead of being interleaved.
+
+    Args:
+        wrapper: The environment wrapper, empty for no wrapper
+        setup: The setup prefix shared by the checks, or None
+        items: A list of (key, cond, check, body, stdout, logfile) tuples,
+            where body is the check with the wrapper and the setup stripped
+        status: The status of the checks
+        errors: The errors of the checks
+        max_output: Keep only the last so many bytes of the output of a check
+        limits: The resource limits of the shell, inherited by the checks,
+            see _limit_resources
+
+    Returns:
+        The resource usage of the session, or None if nothing was run.
+        The durations of the checks are in its `durations` (key => seconds).
+    """
+    # check => [body, stdout, logfile, keys]
+    todo = {}
+    for key, cond, check, body, stdout, logfile in items:
+        status[key] = CheckingStatus.CHECKING
+        if not _is_true(cond):
+            status[key] = CheckingStatus.IF_SKIPPING
+            continue
+        todo.setdefault(check, [body, stdout, logfile, []])[3].append(key)
+
+    if not todo:
+        return
+
+    durations = {}
+
+    def _settle(check, returncode, output, duration=None):
+        if returncode == 0:
+            STATUSES[check] = CheckingStatus.SUCCESS.value
+        else:
+            STATUSES[check] = output
+        for key in todo[check][3]:
+            durations[key] = duration
+            if returncode == 0:
+                status[key] = CheckingStatus.SUCCESS
+            else:
+                errors[key] = output
+                status[key] = CheckingStatus.ERROR
+
+    # The script is fed to the shell on stdin, and the output of the checks is
+    # sent back after the markers, so that nothing is shared through the file
+    # system, which may differ inside a container (e.g. a private /tmp)
+    checks = list(todo)
+    script = [
+        "__pipen_require_dir=$(mktemp -d) || exit $?",
+        "trap 'rm -rf \"$__pipen_require_dir\"' EXIT",
+    ]
+    out, err = '"$__pipen_require_dir/out"', '"$__pipen_require_dir/err"'
+    if setup is not None:
+        script.append(f"{setup} < /dev/null || exit $?")
+    for i, check in enumerate(checks):
+        body, stdout, logfile, _ = todo[check]
+        STATUSES[check] = CheckingStatus.CHECKING.value
+        script.append(f": > {out}")
+        if stdout:
+            redirect = f"> {err} 2>&1"
+        else:
+            redirect = f"> {out if logfile else '/dev/null'} 2> {err}"
+        script.append(f"(\n{body}\n) < /dev/null {redirect}")
+        script.append("__rc=$?")
+        script.append(
+            f'echo "{SESSION_MARKER} {i} $__rc $(wc -c < {out}) $(wc -c < {err})"'
+        )
+        script.append(f"cat {out} {err}")
+    script = ("\n".join(script) + "\n").encode()
+
+    def _feed(stdin):
+        try:
+            stdin.write(script)
+            stdin.close()
+        except BrokenPipeError:  # pragma: no cover
+            pass
+
+    with TemporaryFile() as sessionerr:
+        start = monotonic()
+        p = Popen(
+            ["/usr/bin/env", *shlex.split(wrapper), "bash", "-s"],
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=sessionerr,
+            preexec_fn=_limit_resources(limits),
+        )
+        # Feed the script in a thread, the shell may block on the output
+        feeder = Thread(target=_feed, args=(p.stdin,), daemon=True)
+        feeder.start()
+        done = set()
+        last = start
+        for line in iter(p.stdout.readline, b""):
+            parts = line.decode("utf-8", errors="replace").split()
+            if len(parts) != 5 or parts[0] != SESSION_MARKER:
+                continue
+            i, returncode, nout, nerr = map(int, parts[1:])
+            logfile = todo[checks[i]][2]
+            logfh = None
+            if logfile is not None:
+                Path(logfile).parent.mkdir(parents=True, exist_ok=True)
+                logfh = open(logfile, "wb")
+            try:
+                _read_payload(p.stdout, nout, logfh=logfh)
+                output = _read_payload(p.stdout, nerr, max_output, logfh)
+            finally:
+                if logfh is not None:
+                    logfh.close()
+            now = monotonic()
+            _settle(checks[i], returncode, output, now - last)
+            last = now
+            done.add(i)
+        p.stdout.close()
+        usage = _wait(p, start)
+        feeder.join()
+
+        # The session died before finishing all the checks
+        error = _read_tail(sessionerr, max_output) or (
+            f"Session exited with {p.returncode}: {wrapper} {setup or ''}"
+        )
+        for i, check in enumerate(checks):
+            if i not in done:
+                _settle(check, p.returncode or 1, error)
+
+    usage.durations = durations
+    return usage
+
+
+def _warn_history(path: str, action: str, err: Exception):
+    """Warn that the history store is not available"""
+    Console().print(
+        f"[yellow]Warning: failed to {action} the history store {path}: "
+        f"{err}[/yellow]"
+    )
+
+
 class PipenRequire:
-    """The class to extract and check requirements"""
+    """The class to extract and check requirements
+
+    When ncores is "auto", the number of checks to run at the same time adapts
+    to the load and the free memory of the machine, and the observed CPU
+    profile of the checks. The weight of each check (1 by default) counts
+    against the number of cores.
+    """
 
     def __init__(
         self,
         pipeline: str,
         pipeline_args: List[str],
-        ncores: int,
+        ncores: int | str,
         verbose: bool,
+        max_output: int = DEFAULT_MAX_OUTPUT,
+        logdir: str | None = None,
+        reuse_env: bool = False,
+        fold_setup: bool = False,
+        history_db: str | None = None,
+        limits: Mapping[str, int] | None = None,
+        export: str | None = None,
+        snapshot: str | None = None,
     ):
         self.pipeline = pipeline
         self.pipeline_args = pipeline_args
         self.ncores = ncores
         self.verbose = verbose
+        self.max_output = max_output
+        self.logdir = logdir
+        self.reuse_env = reuse_env
+        self.fold_setup = fold_setup
+        self.history_db = history_db
+        # The resource limits of each check, see _limit_resources
+        self.limits = limits
+        # key => resource usage of the checks in this run
+        self.usages = {}
+        # key => expected duration of the checks from the history
+        self.expected = {}
+        # key => expected max rss of the checks from the history
+        self.expected_rss = {}
+        # The snapshot to export the checks and their results to
+        self.export = export
+        # The snapshot to reuse the results of the unchanged checks from
+        self.snapshot = snapshot
+        # check => keys of the requirements with the check
+        self.check_keys = {}
+        # The keys of the requirements with results reused from the snapshot
+        self.reused = set()
+        # The log files of the checks, shared by the checks with the same command
+        self.logfiles = {}
         self.status = Manager().dict()
         self.errors = Manager().dict()
         self.pool = None
         self.results = OrderedDiot()
+        # The statistics of the planning, see _start_requirements_check
+        self.plan = None
+        self.limiter = AdaptiveLimiter() if ncores == "auto" else None
+        # The tasks waiting to be dispatched: (weight, func, args, keys)
+        self.queue = deque()
+        # The weights of the running tasks
+        self.running = 0.0
+        # The number of the workers and of the tasks dispatched to them
+        self.workers = 1
+        self.active = 0
+        self.lock = RLock()
 
     def _generate_tree(self, all_reqs: Mapping[str, Mapping[str, str]]):
         """Generate a tree to show requirements checking"""
@@ -170,7 +996,9 @@ class PipenRequire:
                     Status(f"[yellow]{cname}[/yellow]", spinner="dots")
                 )
             elif status == CheckingStatus.SUCCESS:
-                subtrees[pname].add(f"[green]✅ {cname}[/green]")
+                subtrees[pname].add(
+                    f"[green]✅ {cname}[/green]{self._extra_label(name)}"
+                )
             elif status == CheckingStatus.IF_SKIPPING:
                 subtrees[pname].add(
                     f"[green]⏩ {cname}[/green] "
@@ -180,32 +1008,58 @@ class PipenRequire:
                 subtree = subtrees[pname].add(
                     f"[red]❎ {cname}: "
                     f"{all_reqs[pname][cname]['message']}[/red]"
+                    f"{self._extra_label(name)}"
                 )
 
                 if self.verbose:
                     subtree.add(f"[red]{self.errors[name]}[/red]")
+                if name in self.logfiles:
+                    subtree.add(
+                        f"[yellow]Full log: {self.logfiles[name]}[/yellow]"
+                    )
 
         return tree
 
+    def _extra_label(self, key: str) -> str:
+        """Get the label of a finished check, telling if the result is from the
+        snapshot, or the resource usage when verbose"""
+        if key in self.reused:
+            return " [dim](from snapshot)[/dim]"
+        if not self.verbose or key not in self.usages:
+            return ""
+        return f" [dim]({_format_usage(self.usages[key])})[/dim]"
+
     def _update_status(self):
         """Update the status of the checking"""
-        for pname, rets in self.results.items():
-            for cname, ret in rets.items():
-                key = f"{pname}/{cname}"
-                if not ret.ready():
-                    pass
-                elif ret.successful():
-                    if self.status[key] == CheckingStatus.CHECKING:
-                        self.status[key] = CheckingStatus.SUCCESS
-                else:
-                    self.status[key] = CheckingStatus.ERROR
+        # Tasks are dispatched by the pool callbacks as well
+        with self.lock:
+            results = [
+                (f"{pname}/{cname}", ret)
+                for pname, rets in self.results.items()
+                for cname, ret in rets.items()
+            ]
+
+        for key, ret in results:
+            if not ret.ready():
+                pass
+            elif ret.successful():
+                if self.status[key] == CheckingStatus.CHECKING:
+                    self.status[key] = CheckingStatus.SUCCESS
+            else:
+                self.status[key] = CheckingStatus.ERROR
 
     def _start_requirements_check(
         self,
         all_reqs: Mapping[str, Mapping[str, str]],
     ):
         """Run the requirements check"""
-        self.pool = Pool(processes=self.ncores)
+        # check => log file, only the first check with the same command runs
+        check_logfiles = {}
+        # check => the requirements to check by it:
+        #   [(pname, cname, stdout, logfile, weight)]
+        # Those skipped by if-statements are resolved here, without dispatching
+        checks = {}
+        nreqs = if_skipped = 0
         for pname, reqs in all_reqs.items():
             self.results.setdefault(pname, {})
             if len(reqs) == 1:
@@ -216,18 +1070,238 @@ class PipenRequire:
             for cname, req in reqs.items():
                 if cname == PROC_SUMMARY_NAME:
                     continue
+                nreqs += 1
+                if not _is_true(req.get("if_", "true") or "true"):
+                    self.status[f"{pname}/{cname}"] = CheckingStatus.IF_SKIPPING
+                    if_skipped += 1
+                    continue
+
                 self.status[f"{pname}/{cname}"] = CheckingStatus.PENDING
-                self.results[pname][cname] = self.pool.apply_async(
+                logfile = check_logfiles.setdefault(
+                    req["check"],
+                    _log_file(self.logdir, pname, cname),
+                )
+                if logfile is not None:
+                    self.logfiles[f"{pname}/{cname}"] = logfile
+                checks.setdefault(req["check"], []).append(
+                    (
+                        pname,
+                        cname,
+                        req.get("stdout", False),
+                        logfile,
+                        req.get("weight", 1.0),
+                    )
+                )
+
+        self.check_keys = {
+            check: [f"{req[0]}/{req[1]}" for req in reqs]
+            for check, reqs in checks.items()
+        }
+        reused = {}
+        if self.snapshot is not None:
+            reused = reusable_results(load_snapshot(self.snapshot), checks)
+            # Only the successes are reused, the failed checks are run again
+            for check in reused:
+                for key in self.check_keys[check]:
+                    self.reused.add(key)
+                    self.status[key] = CheckingStatus.SUCCESS
+
+        # (wrapper, setup) => [(check, body)]
+        # The checks sharing the environment wrapper (with --reuse-env) and/or
+        # the setup prefix (with --fold-setup) are folded into one session,
+        # where the environment is activated and the setup is run only once
+        groups = {}
+        for check in checks:
+            if check in reused:
+                continue
+            # Requirements without a check are run (and fail) on their own
+            wrapper, body = (
+                _split_env_wrapper(check)
+                if self.reuse_env and check is not None
+                else (None, check)
+            )
+            setup, body = (
+                _split_setup_prefix(body)
+                if self.fold_setup and check is not None
+                else (None, body)
+            )
+            groups.setdefault((wrapper, setup), []).append((check, body))
+
+        folded = 0
+        for (wrapper, setup), members in groups.items():
+            if len(members) > 1 and (wrapper is not None or setup is not None):
+                folded += len(members) - 1
+                reqs = [req for check, _ in members for req in checks[check]]
+                self._submit(
+                    _run_session,
+                    (
+                        wrapper or "",
+                        setup,
+                        [
+                            (f"{pname}/{cname}", "true", check, body, stdout, logfile)
+                            for check, body in members
+                            for pname, cname, stdout, logfile, _ in checks[check]
+                        ],
+                        self.status,
+                        self.errors,
+                        self.max_output,
+                        self.limits,
+                    ),
+                    # Checks in a session run one after another
+                    max(req[4] for req in reqs),
+                    [req[:2] for req in reqs],
+                )
+                continue
+
+            for check, _ in members:
+                (pname, cname, stdout, logfile, _), *aliases = checks[check]
+                self._submit(
                     _run_check,
-                    args=(
+                    (
                         pname,
                         cname,
-                        req.get("if_", "true") or "true",
-                        req["check"],
+                        "true",
+                        check,
                         self.status,
                         self.errors,
+                        stdout,
+                        self.max_output,
+                        logfile,
+                        [f"{alias[0]}/{alias[1]}" for alias in aliases],
+                        self.limits,
+                    ),
+                    max(req[4] for req in checks[check]),
+                    [req[:2] for req in checks[check]],
+                )
+
+        self.plan = Diot(
+            requirements=nreqs,
+            dispatches=len(self.queue),
+            if_skipped=if_skipped,
+            duplicated=nreqs - if_skipped - len(checks),
+            folded=folded,
+            reused=len(reused),
+        )
+
+        if self.expected:
+            # Start the longest checks first, so they do not hold the run up
+            self.queue = deque(
+                sorted(
+                    self.queue,
+                    key=lambda task: -sum(
+                        self.expected.get(f"{pname}/{cname}", 0.0)
+                        for pname, cname in task[3]
+                    ),
+                )
+            )
+
+        # Fork only as many workers as can be busy at the same time
+        self.workers = max(
+            1,
+            min(
+                len(self.queue),
+                (
+                    self.limiter.max_workers
+                    if self.limiter is not None
+                    else self.ncores
+                ),
+            ),
+        )
+        self.pool = Pool(processes=self.workers)
+        self._dispatch()
+
+    def _capacity(self) -> float:
+        """Get the number of checks (in units of weight) that can run"""
+        if self.limiter is not None:
+            return self.limiter.capacity(self.running)
+        return float(self.ncores)
+
+    def _fits_memory(self, keys: List[Tuple[str, str]]) -> bool:
+        """Check if the memory used by the checks in the history is available"""
+        if self.limiter is None:
+            return True
+        rss = max(
+            (self.expected_rss.get(f"{pname}/{cname}", 0) for pname, cname in keys),
+            default=0,
+        )
+        return self.limiter.fits_memory(rss)
+
+    def _submit(
+        self,
+        func: Callable,
+        args: Tuple,
+        weight: float,
+        keys: List[Tuple[str, str]],
+    ):
+        """Queue a task to be dispatched to the pool
+
+        Args:
+            func: The function to run the check(s)
+            args: The arguments of the function
+            weight: The weight of the task
+            keys: The (pname, cname) of the checks run by the task
+        """
+        self.queue.append((weight, func, args, keys))
+
+    def _dispatch(self):
+        """Dispatch the queued tasks to the pool as long as capacity allows
+
+        A task that is heavier than the capacity runs when nothing else runs.
+        No more tasks are dispatched than there are workers, so that the
+        queued ones are not counted as running.
+        In auto mode, a task that used more memory in the history than what
+        is available now waits for the running ones as well.
+        """
+        with self.lock:
+            while self.queue:
+                weight, func, args, keys = self.queue[0]
+                if self.active >= self.workers or (
+                    self.running > 0
+                    and (
+                        self.running + weight > self._capacity()
+                        or not self._fits_memory(keys)
+                    )
+                ):
+                    break
+
+                self.queue.popleft()
+                self.running += weight
+                self.active += 1
+                ret = self.pool.apply_async(
+                    func,
+                    args=args,
+                    callback=lambda usage, w=weight, k=keys: self._task_done(
+                        w, k, usage
+                    ),
+                    error_callback=lambda err, w=weight, k=keys: self._task_done(
+                        w, k, getattr(err, "usage", None)
                     ),
                 )
+                for pname, cname in keys:
+                    self.results[pname][cname] = ret
+
+    def _task_done(
+        self,
+        weight: float,
+        keys: List[Tuple[str, str]],
+        usage: Any = None,
+    ):
+        """Called by the pool when a task is done"""
+        with self.lock:
+            self.running -= weight
+            self.active -= 1
+            if usage is not None:
+                durations = usage.get("durations")
+                for pname, cname in keys:
+                    key = f"{pname}/{cname}"
+                    if durations is None:
+                        self.usages[key] = usage
+                    elif durations.get(key) is not None:
+                        # Only the wall time of a check is known in a session
+                        self.usages[key] = Diot(wall=durations[key])
+                if self.limiter is not None:
+                    self.limiter.observe(usage.wall, usage.cpu)
+            self._dispatch()
 
     def all_done(self):
         """Check if all requirements are done"""
@@ -242,26 +1316,165 @@ class PipenRequire:
             for _, status in self.status.items()
         )
 
+    def _load_history(self):
+        """Load the expected durations and max rss from the history store"""
+        try:
+            store = HistoryStore(self.history_db)
+            try:
+                self.expected = store.durations(self.pipeline.name)
+                self.expected_rss = store.max_rss(self.pipeline.name)
+            finally:
+                store.close()
+        except (sqlite3.Error, OSError) as err:
+            _warn_history(self.history_db, "read", err)
+
+    def _record_history(self, run: float):
+        """Append the results of the checks to the history store"""
+        try:
+            self._write_history(run)
+        except (sqlite3.Error, OSError) as err:
+            # e.g. a read-only or locked HOME, the results are still shown
+            _warn_history(self.history_db, "record the results to", err)
+
+    def _write_history(self, run: float):
+        """Write the results of the checks to the history store"""
+        store = HistoryStore(self.history_db)
+        try:
+            store.record(
+                run,
+                self.pipeline.name,
+                environment_fingerprint(),
+                [
+                    (
+                        key,
+                        status.name.lower(),
+                        self.usages.get(key, {}).get("wall"),
+                        self.usages.get(key, {}).get("maxrss"),
+                    )
+                    for key, status in self.status.items()
+                    if status != CheckingStatus.SKIPPING
+                ],
+            )
+        finally:
+            store.close()
+
+    def _export_snapshot(self):
+        """Export the checks and their results to a snapshot"""
+        results = {}
+        for check, keys in self.check_keys.items():
+            if check is None:
+                # Nothing to verify later
+                continue
+            status = self.status[keys[0]]
+            if status == CheckingStatus.SUCCESS:
+                results[check] = {"status": "success", "error": None}
+            elif status == CheckingStatus.ERROR:
+                results[check] = {
+                    "status": "error",
+                    "error": self.errors.get(keys[0]),
+                }
+            else:  # pragma: no cover
+                continue
+            results[check]["keys"] = keys
+        save_snapshot(self.export, self.pipeline.name, results)
+
+    async def history(self, console: Console | None = None):
+        """Show the history of the checks of the pipeline"""
+        self.pipeline = await load_pipeline(
+            self.pipeline,
+            argv0=sys.argv[0],
+            argv1p=self.pipeline_args,
+        )
+        store = HistoryStore(self.history_db)
+        try:
+            report = store.report(self.pipeline.name)
+        finally:
+            store.close()
+
+        table = Table(
+            title=(
+                "History of the requirements checking for pipeline: "
+                f"[bold]{self.pipeline.name.upper()}[/bold]"
+            ),
+        )
+        table.add_column("Check")
+        table.add_column("Runs", justify="right")
+        table.add_column("Failures", justify="right")
+        table.add_column("Last status")
+        table.add_column("Duration (s)", justify="right")
+        table.add_column("Max RSS", justify="right")
+        table.add_column("Notes")
+        for summary in report:
+            notes = []
+            if summary.flips >= 2:
+                notes.append(f"[yellow]flaky ({summary.flips} flips)[/yellow]")
+            if summary.failing_since is not None:
+                since = datetime.fromtimestamp(summary.failing_since)
+                notes.append(
+                    f"[red]failing since {since:%Y-%m-%d %H:%M:%S}[/red]"
+                )
+            if summary.regression:
+                notes.append(
+                    f"[red]slower than median {summary.median:.2f}s[/red]"
+                )
+            table.add_row(
+                summary.key,
+                str(summary.runs),
+                str(summary.failures),
+                summary.status,
+                "" if summary.duration is None else f"{summary.duration:.2f}",
+                "" if summary.max_rss is None else _format_bytes(summary.max_rss),
+                ", ".join(notes),
+            )
+
+        (console or Console()).print(table)
+
     async def run(self):
         """Run the pipeline"""
+        run_started = time()
         self.pipeline = await load_pipeline(
             self.pipeline,
             argv0=sys.argv[0],
             argv1p=self.pipeline_args,
         )
-        all_reqs = OrderedDiot()
-        for proc in self.pipeline.procs:
-            anno, requires = parse_proc_requirements(proc)
-            all_reqs[proc.name] = requires
-            all_reqs[proc.name][PROC_SUMMARY_NAME] = anno.Summary.short
+        if self.history_db is not None:
+            self._load_history()
+
+        all_reqs = _parse_requirements(
+            self.pipeline.procs,
+            self.limiter.max_workers if self.limiter is not None else self.ncores,
+        )
 
         self._start_requirements_check(all_reqs)
 
         with Live(self._generate_tree(all_reqs)) as live:
             while not self.all_done():
                 sleep(0.8)
+                self._dispatch()
                 live.update(self._generate_tree(all_reqs))
 
+        avoided = self.plan.requirements - self.plan.dispatches
+        Console().print(
+            f"\nPlanned {self.plan.requirements} requirement(s) in "
+            f"{self.plan.dispatches} dispatch(es), avoided {avoided}: "
+            f"{self.plan.if_skipped} skipped by if-statements, "
+            f"{self.plan.duplicated} duplicated, "
+            f"{self.plan.folded} folded into shared sessions"
+            + (
+                f", {self.plan.reused} reused from the snapshot"
+                if self.snapshot is not None
+                else ""
+            )
+        )
+
+        # Wait for the callbacks to collect the durations
+        self.pool.close()
+        self.pool.join()
+        if self.history_db is not None:
+            self._record_history(run_started)
+        if self.export is not None:
+            self._export_snapshot()
+
     def __del__(self):
         try:
             if self.pool is not None:
@@ -0,0 +1,154 @@
+"""Provides the AdaptiveLimiter to adapt the concurrency of the checks"""
+from __future__ import annotations
+
+import os
+from typing import Tuple
+
+# The max number of checks (in units of weight) per core in auto mode
+AUTO_CHECKS_PER_CORE = 2
+# Stop growing when the available memory is below this fraction of the total
+MIN_FREE_MEMORY = 0.1
+# The smoothing factor of the observed CPU profile of the checks
+PROFILE_SMOOTHING = 0.3
+# The max number of workers in auto mode, which are forked up front
+AUTO_MAX_WORKERS = 32
+
+
+def _loadavg() -> float | None:
+    """Get the 1-minute load average of the system"""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):  # pragma: no cover
+        return None
+
+
+def _cgroup_cores() -> float | None:
+    """Get the number of cores allowed by the CPU quota of the cgroup"""
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as fh:
+            quota, period = fh.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:  # pragma: no cover
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as fh:
+            quota = int(fh.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as fh:
+            period = int(fh.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):  # pragma: no cover
+        return None
+
+
+def _cpu_count() -> int:
+    """Get the number of cores this process can use
+
+    It respects the CPU affinity (e.g. taskset, SLURM) and the CPU quota of
+    the cgroup (e.g. containers), which `os.cpu_count()` ignores.
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        cores = os.cpu_count() or 1
+    quota = _cgroup_cores()
+    if quota is not None:
+        cores = min(cores, max(1, int(quota)))
+    return max(1, cores)
+
+
+def _memory() -> Tuple[int, int] | None:
+    """Get the available and total memory (in kB) of the system"""
+    try:
+        with open("/proc/meminfo") as fh:
+            info = dict(line.split(":", 1) for line in fh if ":" in line)
+        return (
+            int(info["MemAvailable"].split()[0]),
+            int(info["MemTotal"].split()[0]),
+        )
+    except (OSError, KeyError, ValueError):  # pragma: no cover
+        return None
+
+
+class AdaptiveLimiter:
+    """Decide how many checks can run at the same time
+
+    The capacity is measured in units of the weights of the checks (1 by
+    default). It grows when the machine has idle cores and shrinks when the
+    machine is loaded by other processes or runs short of memory.
+
+    The observed CPU profile of the checks is taken into account: checks that
+    mostly wait for IO do not keep a core busy, so more of them are allowed
+    to run at the same time.
+
+    The checks are run by at most AUTO_MAX_WORKERS workers, so that a large
+    machine is not flooded with idle workers before any adaptation happens.
+
+    Args:
+        cores: The number of cores to use at most, defaults to all the cores
+            this process can use
+    """
+
+    def __init__(self, cores: int | None = None):
+        self.cores = cores or _cpu_count()
+        self.max_capacity = self.cores * AUTO_CHECKS_PER_CORE
+        self.max_workers = min(self.max_capacity, AUTO_MAX_WORKERS)
+        # The ratio of CPU time to wall time of the checks,
+        # assuming they are CPU-bound until observed
+        self.cpu_ratio = 1.0
+
+    def observe(self, wall: float, cpu: float) -> None:
+        """Observe the resource usage of a finished check
+
+        Args:
+            wall: The wall time of the check
+            cpu: The CPU time (user + system) of the check
+        """
+        if wall <= 0:
+            return
+        ratio = min(1.0, cpu / wall)
+        self.cpu_ratio += PROFILE_SMOOTHING * (ratio - self.cpu_ratio)
+
+    def fits_memory(self, nbytes: int) -> bool:
+        """Check if so many bytes of memory are available
+
+        Args:
+            nbytes: The number of bytes
+
+        Returns:
+            True if available or unknown
+        """
+        memory = _memory()
+        return memory is None or memory[0] * 1024 >= nbytes
+
+    def capacity(self, running: float) -> float:
+        """Get the number of checks (in units of weight) that can run
+
+        Args:
+            running: The weights of the checks that are running
+
+        Returns:
+            The capacity, at least 1
+        """
+        load = _loadavg()
+        if load is None:  # pragma: no cover
+            idle = float(self.cores)
+        else:
+            # The running checks contribute to the load themselves
+            others = max(0.0, load - running * self.cpu_ratio)
+            idle = max(0.0, self.cores - others)
+
+        capacity = idle / max(self.cpu_ratio, 1.0 / AUTO_CHECKS_PER_CORE)
+
+        memory = _memory()
+        if memory is not None:
+            available, total = memory
+            if available < total * MIN_FREE_MEMORY / 2:
+                capacity = min(capacity, running / 2)
+            elif available < total * MIN_FREE_MEMORY:
+                capacity = min(capacity, running)
+
+        return max(1.0, min(capacity, float(self.max_capacity)))
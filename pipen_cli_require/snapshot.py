@@ -0,0 +1,92 @@
+"""Provides snapshots of the rendered checks and their results"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Iterable, Mapping
+
+from diot import Diot
+
+from .fingerprint import check_fingerprint, environment_fingerprint
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(
+    path: str | Path,
+    pipeline: str,
+    results: Mapping[str, Mapping[str, str]],
+) -> None:
+    """Save the rendered checks and their results to a snapshot
+
+    Args:
+        path: The path to the snapshot (JSON)
+        pipeline: The name of the pipeline
+        results: The results of the checks, check => a dict with
+            - status: "success" or "error"
+            - error: The error if failed
+            - keys: The requirements (`<proc>/<requirement>`) with the check
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "pipeline": pipeline,
+        "fingerprint": environment_fingerprint(),
+        "checks": {
+            check: {"fingerprint": check_fingerprint(check), **result}
+            for check, result in results.items()
+        },
+    }
+    Path(path).write_text(json.dumps(snapshot, indent=2))
+
+
+def load_snapshot(path: str | Path) -> Diot:
+    """Load a snapshot
+
+    Args:
+        path: The path to the snapshot
+
+    Returns:
+        The snapshot
+
+    Raises:
+        ValueError: If the snapshot is not from a compatible version
+    """
+    snapshot = json.loads(Path(path).read_text())
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot version: {snapshot.get('version')} "
+            f"(expecting {SNAPSHOT_VERSION}): {path}"
+        )
+    return Diot(snapshot, diot_nest=False)
+
+
+def reusable_results(
+    snapshot: Mapping,
+    checks: Iterable[str],
+) -> Mapping[str, Mapping[str, str]]:
+    """Get the results in a snapshot that still hold in this environment
+
+    Only the successes are reused, so that the failed checks are always run
+    again (e.g. after the missing tools are installed). A success is reused
+    only when the environment fingerprint matches and the input fingerprint
+    of the check (the check itself and the executables and files it uses)
+    is unchanged, otherwise the check is run again.
+
+    Args:
+        snapshot: The snapshot
+        checks: The rendered checks to run
+
+    Returns:
+        The reusable results, check => result
+    """
+    out = {}
+    if snapshot["fingerprint"] != environment_fingerprint():
+        return out
+
+    for check in checks:
+        result = snapshot["checks"].get(check)
+        if result is None or result["status"] != "success":
+            continue
+        if result["fingerprint"] == check_fingerprint(check):
+            out[check] = result
+    return out
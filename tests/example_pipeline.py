@@ -20,6 +20,7 @@ class P1(Proc):
           - check: |
             {{proc.lang}} -c "import pipen"
         liquidpy: Run `pip install -U liquidpy` to install
+          - weight: 2
           - check: |
             {{proc.lang}} -c "import liquid"
         nonexist: Run `pip install -U nonexist` to install
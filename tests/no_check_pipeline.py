@@ -0,0 +1,24 @@
+from pipen import Proc, Pipen
+
+
+class P1(Proc):
+    """Process 1
+
+    Requires:
+        nocheck: Install it manually
+        sourced:
+          - check: |
+            export NO_CHECK=1 && true
+        sourced2:
+          - check: |
+            export NO_CHECK=1 && test "$NO_CHECK" = 1
+    """
+
+    input = "a"
+    output = "outfile:file:out.txt"
+
+
+class ExamplePipeline(Pipen):
+    name = __name__
+    starts = [P1]
+    data = [["a"]]
@@ -2,11 +2,17 @@ import os
 import sys
 import pytest
 from pathlib import Path
-from subprocess import run
+from subprocess import PIPE, run
 
 from pipen import Pipen
+from rich.console import Console
 from pipen.utils import load_pipeline
-from pipen_cli_require.require import PipenRequire
+from pipen_cli_require.require import (
+    PipenRequire,
+    STATUSES,
+    parse_proc_requirements,
+)
+from pipen_cli_require.snapshot import load_snapshot
 
 EXAMPLE_P1 = str(
     Path(__file__).parent / "example_pipeline.py:P1"
@@ -20,6 +26,10 @@ EXAMPLE_PIPELINE = str(
     Path(__file__).parent / "example_pipeline.py:ExamplePipeline"
 )
 
+NO_CHECK_PIPELINE = str(
+    Path(__file__).parent / "no_check_pipeline.py:ExamplePipeline"
+)
+
 
 @pytest.mark.asyncio
 async def test_init():
@@ -63,6 +73,10 @@ async def test_normal_run(capsys):
     assert "liquidpy" in out
     assert "No module named 'nonexist'" in out
     assert "Skipped, no requirements specified." in out
+    assert "Planned 10 requirement(s) in 4 dispatch(es), avoided 6" in out
+    assert pr.plan.if_skipped == 2
+    assert pr.plan.duplicated == 4
+    assert pr.plan.folded == 0
 
 
 @pytest.mark.asyncio
@@ -89,12 +103,128 @@ async def test_normal_run_p1(capsys):
     assert "Skipped, no requirements specified." in out
 
 
+@pytest.mark.asyncio
+async def test_auto_ncores(capsys):
+    pr = PipenRequire(EXAMPLE_PIPELINE, [], ncores="auto", verbose=True)
+    await pr.run()
+    out = capsys.readouterr().out
+    assert "No module named 'nonexist'" in out
+    assert pr.running == 0
+    assert pr.active == 0
+    assert not pr.queue
+    # No more workers than the dispatches
+    assert pr.workers <= pr.plan.dispatches
+
+
+@pytest.mark.asyncio
+async def test_weight():
+    pipeline = await load_pipeline(EXAMPLE_PIPELINE)
+    _, reqs = parse_proc_requirements(pipeline.procs[0])
+    assert reqs.pipen.weight == 1.0
+    assert reqs.liquidpy.weight == 2.0
+
+
+@pytest.mark.asyncio
+async def test_history(tmp_path, capsys):
+    history_db = tmp_path / "history.db"
+    # Make sure the checks are not cached by other tests
+    STATUSES.clear()
+    pr = PipenRequire(EXAMPLE_P1, [], 2, False, history_db=history_db)
+    await pr.run()
+    assert pr.usages["P1/pipen"].wall > 0
+    assert "maxrss" in pr.usages["P1/pipen"]
+
+    pr = PipenRequire(EXAMPLE_P1, [], 2, False, history_db=history_db)
+    await pr.run()
+    assert pr.expected["P1/pipen"] > 0
+    capsys.readouterr()
+
+    await PipenRequire(EXAMPLE_P1, [], 1, False, history_db=history_db).history(
+        Console(width=200)
+    )
+    out = capsys.readouterr().out
+    assert "P1/nonexist" in out
+    assert "failing since" in out
+    assert "if_skipping" in out
+
+
+@pytest.mark.asyncio
+async def test_history_unavailable(tmp_path, capsys):
+    # The parent of the database is a file, so the store cannot be created
+    (tmp_path / "file").touch()
+    pr = PipenRequire(
+        EXAMPLE_P1, [], 1, False, history_db=tmp_path / "file" / "history.db"
+    )
+    await pr.run()
+    out = capsys.readouterr().out
+    assert "Warning: failed to read the history store" in out
+    assert "Warning: failed to record the results to the history store" in out
+    assert pr.status["P1/pipen"].name == "SUCCESS"
+
+
+@pytest.mark.asyncio
+async def test_limits(capsys):
+    STATUSES.clear()
+    pr = PipenRequire(
+        EXAMPLE_P1,
+        [],
+        ncores=1,
+        verbose=True,
+        limits={"memory": None, "cputime": 10, "files": 256},
+    )
+    await pr.run()
+    out = capsys.readouterr().out
+    assert "cpu" in out
+    assert "No module named 'nonexist'" in out
+
+
+@pytest.mark.asyncio
+async def test_snapshot(tmp_path, capsys):
+    snapshot = tmp_path / "snapshot.json"
+    pr = PipenRequire(EXAMPLE_P1, [], 1, True, export=snapshot)
+    await pr.run()
+    assert snapshot.is_file()
+    capsys.readouterr()
+
+    pr = PipenRequire(EXAMPLE_P1, [], 1, True, snapshot=snapshot)
+    await pr.run()
+    out = capsys.readouterr().out
+    # The failed checks are run again
+    assert pr.plan.dispatches == 2
+    assert pr.plan.reused == 2
+    assert "P1/nonexist" not in pr.reused
+    assert "(from snapshot)" in out
+    assert "No module named 'nonexist'" in out
+    assert "2 reused from the" in out
+
+
+@pytest.mark.asyncio
+async def test_no_check(tmp_path):
+    snapshot = tmp_path / "snapshot.json"
+    pr = PipenRequire(
+        NO_CHECK_PIPELINE,
+        [],
+        1,
+        False,
+        reuse_env=True,
+        fold_setup=True,
+        export=snapshot,
+    )
+    await pr.run()
+    assert pr.status["P1/nocheck"].name == "ERROR"
+    assert pr.status["P1/sourced"].name == "SUCCESS"
+    assert pr.status["P1/sourced2"].name == "SUCCESS"
+    assert pr.plan.folded == 1
+    assert len(load_snapshot(snapshot).checks) == 2
+
+
 def test_cli():
     cmd = [
         sys.executable,
         "-m",
         "pipen",
         "require",
+        "--no-history",
         "-p",
         EXAMPLE_PIPELINE,
     ]
@@ -114,6 +244,7 @@ def test_cli_wrong_args():
         "-m",
         "pipen",
         "require",
+        "--no-history",
         "pipeline",
     ]
     p = run(
@@ -126,12 +257,114 @@ def test_cli_wrong_args():
     assert p.returncode != 0
 
 
+def test_cli_auto_ncores():
+    cmd = [
+        sys.executable,
+        "-m",
+        "pipen",
+        "require",
+        "--no-history",
+        "--ncores",
+        "auto",
+        "-p",
+        EXAMPLE_PIPELINE,
+    ]
+    p = run(
+        cmd,
+        stdout=None,
+        stderr=None,
+        preexec_fn=os.setpgrp,
+        close_fds=True,
+    )
+    assert p.returncode == 0
+
+
+def test_cli_wrong_ncores():
+    cmd = [
+        sys.executable,
+        "-m",
+        "pipen",
+        "require",
+        "--no-history",
+        "--ncores",
+        "0",
+        "-p",
+        EXAMPLE_PIPELINE,
+    ]
+    p = run(
+        cmd,
+        stdout=None,
+        stderr=None,
+        preexec_fn=os.setpgrp,
+        close_fds=True,
+    )
+    assert p.returncode != 0
+
+
+def test_cli_missing_snapshot(tmp_path):
+    cmd = [
+        sys.executable,
+        "-m",
+        "pipen",
+        "require",
+        "--no-history",
+        "--verify-snapshot",
+        str(tmp_path / "nonexist.json"),
+        "-p",
+        EXAMPLE_PIPELINE,
+    ]
+    p = run(
+        cmd,
+        stdout=None,
+        stderr=PIPE,
+        preexec_fn=os.setpgrp,
+        close_fds=True,
+    )
+    assert p.returncode != 0
+    assert b"--verify-snapshot: no such file" in p.stderr
+    assert b"Traceback" not in p.stderr
+
+
+@pytest.mark.parametrize(
+    "option,value",
+    [
+        ("--max-cputime", "-5"),
+        ("--max-files", "0"),
+        ("--max-output", "-1"),
+        ("--max-memory", "0"),
+        ("--max-memory", "4X"),
+    ],
+)
+def test_cli_wrong_limits(option, value):
+    cmd = [
+        sys.executable,
+        "-m",
+        "pipen",
+        "require",
+        "--no-history",
+        option,
+        value,
+        "-p",
+        EXAMPLE_PIPELINE,
+    ]
+    p = run(
+        cmd,
+        stdout=None,
+        stderr=PIPE,
+        preexec_fn=os.setpgrp,
+        close_fds=True,
+    )
+    assert p.returncode != 0
+    assert f"argument {option}: must be a positive".encode() in p.stderr
+
+
 def test_cli_unparsed_args():
     cmd = [
         sys.executable,
         "-m",
         "pipen",
         "require",
+        "--no-history",
         "-p",
         "pipeline:Pipeline",
         "-abc",
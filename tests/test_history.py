@@ -0,0 +1,90 @@
+import pytest  # noqa
+
+from pipen_cli_require.fingerprint import environment_fingerprint
+from pipen_cli_require.history import HistoryStore
+
+
+def test_fingerprint(monkeypatch):
+    fingerprint = environment_fingerprint()
+    assert len(fingerprint) == 16
+    assert environment_fingerprint() == fingerprint
+    monkeypatch.setenv("CONDA_PREFIX", "/envs/__other__")
+    assert environment_fingerprint() != fingerprint
+
+
+def test_history(tmp_path):
+    store = HistoryStore(tmp_path / "sub" / "history.db")
+    runs = [
+        [
+            ("P1/a", "success", 1.0, 100),
+            ("P1/b", "success", 0.1, None),
+            ("P1/c", "error", 1, 10),
+        ],
+        [
+            ("P1/a", "success", 1.2, 300),
+            ("P1/b", "error", 0.1, None),
+            ("P1/c", "error", 1, 10),
+        ],
+        [
+            ("P1/a", "success", 0.8, 200),
+            ("P1/b", "success", 0.1, None),
+            ("P1/c", "error", 1, 10),
+        ],
+        [
+            ("P1/a", "success", 3.0, 100),
+            ("P1/b", "error", 0.1, None),
+            ("P1/c", "error", 1, 10),
+        ],
+    ]
+    for i, records in enumerate(runs):
+        store.record(100.0 + i, "pipeline", "fp", records)
+    store.record(200.0, "other", "fp", [("P1/a", "error", None, None)])
+
+    assert store.max_rss("pipeline") == {"P1/a": 300, "P1/c": 10}
+    assert store.max_rss("pipeline", runs=1) == {"P1/a": 100, "P1/c": 10}
+
+    durations = store.durations("pipeline")
+    assert durations["P1/a"] == pytest.approx(1.1)
+    assert store.durations("pipeline", runs=1)["P1/a"] == 3.0
+    assert store.durations("nonexist") == {}
+
+    report = {summary.key: summary for summary in store.report("pipeline")}
+    assert list(report) == ["P1/a", "P1/b", "P1/c"]
+
+    assert report["P1/a"].runs == 4
+    assert report["P1/a"].failures == 0
+    assert report["P1/a"].flips == 0
+    assert report["P1/a"].median == 1.0
+    assert report["P1/a"].regression
+    assert report["P1/a"].failing_since is None
+    assert report["P1/a"].max_rss == 300
+    assert report["P1/b"].max_rss is None
+
+    assert report["P1/b"].flips == 3
+    assert report["P1/b"].status == "error"
+    assert report["P1/b"].failing_since == 103.0
+    assert not report["P1/b"].regression
+
+    assert report["P1/c"].failures == 4
+    assert report["P1/c"].failing_since == 100.0
+
+    report = store.report("pipeline", runs=2)
+    assert report[0].runs == 2
+    store.close()
+
+
+def test_history_if_skipping(tmp_path):
+    store = HistoryStore(tmp_path / "history.db")
+    for i, status in enumerate(
+        ["success", "if_skipping", "success", "error", "if_skipping"]
+    ):
+        store.record(100.0 + i, "pipeline", "fp", [("P1/d", status, None, None)])
+
+    (report,) = store.report("pipeline")
+    assert report.runs == 5
+    assert report.status == "if_skipping"
+    # Not flaky because of the runs skipped by the if-statement
+    assert report.flips == 1
+    assert report.failures == 1
+    assert report.failing_since == 103.0
+    store.close()
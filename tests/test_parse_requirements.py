@@ -0,0 +1,61 @@
+import pytest  # noqa
+
+from pipen import Proc
+from pipen_cli_require.require import (
+    PARALLEL_PARSE_MIN_PROCS,
+    PROC_SUMMARY_NAME,
+    _parse_requirements,
+    parse_proc_requirements,
+)
+
+from .example_pipeline import P1, P3
+
+
+def _build_procs(n):
+    return [
+        Proc.from_proc(
+            P1,
+            name=f"Q{i}",
+            envs={"require_conditional": i % 2 == 0},
+        )
+        for i in range(n)
+    ] + [P3]
+
+
+def test_parse_requirements_serial():
+    procs = _build_procs(3)
+    all_reqs = _parse_requirements(procs)
+    assert list(all_reqs) == ["Q0", "Q1", "Q2", "P3"]
+    assert all_reqs.Q0[PROC_SUMMARY_NAME] == "Process 1"
+    assert all_reqs.Q0.conditional.if_ == "True"
+    assert all_reqs.Q1.conditional.if_ == "False"
+    assert all_reqs.P3[PROC_SUMMARY_NAME] == (
+        "No requirements specified but inherits from P1"
+    )
+    for proc in procs:
+        _, requires = parse_proc_requirements(proc)
+        requires[PROC_SUMMARY_NAME] = all_reqs[proc.name][PROC_SUMMARY_NAME]
+        assert all_reqs[proc.name] == requires
+
+
+def test_parse_requirements_parallel():
+    procs = _build_procs(PARALLEL_PARSE_MIN_PROCS)
+    serial = _parse_requirements(procs)
+    parallel = _parse_requirements(procs, ncores=3)
+    assert list(parallel) == [proc.name for proc in procs]
+    assert parallel == serial
+
+
+@pytest.mark.parametrize("weight", ["0", "-1", "heavy"])
+def test_parse_requirements_invalid_weight(weight):
+    class QWeight(Proc):
+        __doc__ = f"""Process with an invalid weight
+
+        Requires:
+            tool: Install the tool
+              - weight: {weight}
+              - check: true
+        """
+
+    with pytest.raises(ValueError, match=r"\[QWeight\].+'tool'"):
+        parse_proc_requirements(QWeight)
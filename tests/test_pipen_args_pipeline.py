@@ -18,6 +18,7 @@ def test_with_real_python():
             "-m",
             "pipen",
             "require",
+            "--no-history",
             "--verbose",
             "-p",
             PIPEN_ARGS_PIPELINE,
@@ -36,6 +37,7 @@ def test_with_fake_python():
             "-m",
             "pipen",
             "require",
+            "--no-history",
             "--verbose",
             "-p",
             PIPEN_ARGS_PIPELINE,
@@ -1,7 +1,15 @@
 import pytest  # noqa
 
 from subprocess import CalledProcessError
-from pipen_cli_require.require import _run_check, CheckingStatus, STATUSES
+from pipen_cli_require.require import (
+    _run_check,
+    _run_session,
+    _split_env_wrapper,
+    _split_setup_prefix,
+    CheckingStatus,
+    SESSION_MARKER,
+    STATUSES,
+)
 
 
 def test_run_check():
@@ -59,3 +67,365 @@ def test_run_check():
         status,
         errors,
     )
+
+
+def test_run_check_bounded_output(tmp_path):
+    status = {}
+    errors = {}
+    logfile = tmp_path / "proc.req.log"
+    check = "echo out-1; printf 'x%.0s' {1..100} >&2; echo err-1 >&2; exit 1"
+    with pytest.raises(CalledProcessError):
+        _run_check(
+            "proc",
+            "bounded",
+            "true",
+            check,
+            status,
+            errors,
+            max_output=10,
+            logfile=logfile,
+        )
+
+    error = errors["proc/bounded"]
+    assert "truncated to the last 10 bytes" in error
+    assert error.endswith("\nxxxxerr-1\n")
+    assert "out-1" not in error
+
+    log = logfile.read_text()
+    assert "out-1" in log
+    assert "x" * 100 in log
+    assert "err-1" in log
+
+
+def test_run_check_capture_stdout():
+    status = {}
+    errors = {}
+    with pytest.raises(CalledProcessError):
+        _run_check(
+            "proc",
+            "stdout",
+            "true",
+            "echo out-2; exit 1",
+            status,
+            errors,
+            stdout=True,
+        )
+    assert errors["proc/stdout"] == "out-2\n"
+
+
+@pytest.mark.parametrize(
+    "check,wrapper,body",
+    [
+        ("python -c 'import x'", None, "python -c 'import x'"),
+        (
+            "conda run -n env python -c 'import x'",
+            "conda run --no-capture-output -n env",
+            "python -c 'import x'",
+        ),
+        (
+            "mamba run --no-capture-output -p /envs/a Rscript -e 'library(x)'",
+            "mamba run --no-capture-output -p /envs/a",
+            "Rscript -e 'library(x)'",
+        ),
+        (
+            "conda run --cwd /x -n env python -V",
+            "conda run --no-capture-output --cwd /x -n env",
+            "python -V",
+        ),
+        (
+            "singularity exec -B /a:/b --cleanenv img.sif Rscript -e 1",
+            "singularity exec -B /a:/b --cleanenv img.sif",
+            "Rscript -e 1",
+        ),
+        (
+            "singularity exec --home /x img.sif Rscript -e 1",
+            "singularity exec --home /x img.sif",
+            "Rscript -e 1",
+        ),
+        (
+            "apptainer exec -H /x --overlay o.img --network=none img.sif R -e 1",
+            "apptainer exec -H /x --overlay o.img --network=none img.sif",
+            "R -e 1",
+        ),
+        # ambiguous: unknown whether --unknown takes a value
+        (
+            "singularity exec --unknown /x img.sif Rscript -e 1",
+            None,
+            "singularity exec --unknown /x img.sif Rscript -e 1",
+        ),
+        ("conda run -n env", None, "conda run -n env"),
+        ("conda run -n \"$ENV\" python -V", None, "conda run -n \"$ENV\" python -V"),
+        ("conda list", None, "conda list"),
+        (
+            "conda run -n env python -c 'import x' 2>&1 > /dev/null",
+            "conda run --no-capture-output -n env",
+            "python -c 'import x' 2>&1 > /dev/null",
+        ),
+        (
+            "conda run -n env python -c 'import x; import y'",
+            "conda run --no-capture-output -n env",
+            "python -c 'import x; import y'",
+        ),
+        # the commands after the control operators run outside of the env
+        *(
+            (check, None, check)
+            for check in (
+                "conda run -n env python -c 'import x' && python -c 'import y'",
+                "conda run -n env python -c 'import x' || true",
+                "conda run -n env python -V; python -V",
+                "conda run -n env python -V | grep 3",
+                "conda run -n env python -V & wait",
+                "singularity exec img.sif R -e 1 |& grep x",
+                "singularity exec img.sif R -e 1\nR -e 2",
+                "singularity exec img.sif R -e 'x",
+            )
+        ),
+    ],
+)
+def test_split_env_wrapper(check, wrapper, body):
+    assert _split_env_wrapper(check) == (wrapper, body)
+
+
+def test_run_session(tmp_path):
+    status = {}
+    errors = {}
+    logfile = tmp_path / "logs" / "proc.fail.log"
+    _run_session(
+        "env",
+        None,
+        [
+            ("proc/ok", "true", "env-a true", "true", False, None),
+            ("proc/ok2", "true", "env-a true", "true", False, None),
+            ("proc/skip", "false", "env-a false", "false", False, None),
+            (
+                "proc/fail",
+                "true",
+                "env-a fail",
+                "echo out; echo err >&2; exit 3",
+                False,
+                logfile,
+            ),
+            (
+                "proc/stdout",
+                "1",
+                "env-a stdout",
+                "echo out; exit 1",
+                True,
+                None,
+            ),
+        ],
+        status,
+        errors,
+    )
+    assert status["proc/ok"] == CheckingStatus.SUCCESS
+    assert status["proc/ok2"] == CheckingStatus.SUCCESS
+    assert status["proc/skip"] == CheckingStatus.IF_SKIPPING
+    assert status["proc/fail"] == CheckingStatus.ERROR
+    assert status["proc/stdout"] == CheckingStatus.ERROR
+    assert errors["proc/fail"] == "err\n"
+    assert errors["proc/stdout"] == "out\n"
+    assert logfile.read_text() == "out\nerr\n"
+    assert STATUSES["env-a true"] == CheckingStatus.SUCCESS.value
+    assert STATUSES["env-a fail"] == "err\n"
+
+
+def test_run_session_output(tmp_path):
+    status = {}
+    errors = {}
+    logfile = tmp_path / "proc.big.log"
+    _run_session(
+        "env",
+        None,
+        [
+            (
+                "proc/big",
+                "true",
+                "env-a big",
+                "head -c 300000 /dev/zero | tr '\\0' x; "
+                f"echo '{SESSION_MARKER} 1 0 0 0' >&2; exit 1",
+                False,
+                logfile,
+            ),
+            ("proc/after", "true", "env-a after", "true", False, None),
+        ],
+        status,
+        errors,
+        max_output=100,
+    )
+    assert status["proc/big"] == CheckingStatus.ERROR
+    assert status["proc/after"] == CheckingStatus.SUCCESS
+    assert errors["proc/big"].endswith(f"{SESSION_MARKER} 1 0 0 0\n")
+    assert "truncated" not in errors["proc/big"]
+    assert logfile.stat().st_size == 300000 + len(SESSION_MARKER) + 9
+
+
+def test_run_session_broken_wrapper():
+    status = {}
+    errors = {}
+    _run_session(
+        "__nonexist_wrapper__",
+        None,
+        [("proc/broken", "true", "broken true", "true", False, None)],
+        status,
+        errors,
+    )
+    assert status["proc/broken"] == CheckingStatus.ERROR
+    assert "__nonexist_wrapper__" in errors["proc/broken"]
+
+
+def test_run_check_aliases():
+    status = {}
+    errors = {}
+    with pytest.raises(CalledProcessError):
+        _run_check(
+            "proc",
+            "alias1",
+            "true",
+            "echo alias-err >&2; exit 1",
+            status,
+            errors,
+            aliases=["proc2/alias2"],
+        )
+    assert status["proc/alias1"] == CheckingStatus.CHECKING
+    assert status["proc2/alias2"] == CheckingStatus.CHECKING
+    assert errors["proc/alias1"] == errors["proc2/alias2"] == "alias-err\n"
+
+
+@pytest.mark.parametrize(
+    "check,setup,body",
+    [
+        ("python -c 'import x'", None, "python -c 'import x'"),
+        (
+            "source activate env && python -c 'import x'",
+            "source activate env",
+            "python -c 'import x'",
+        ),
+        (
+            "module load R/4.3 gcc && Rscript -e 'library(x)'",
+            "module load R/4.3 gcc",
+            "Rscript -e 'library(x)'",
+        ),
+        ("export A=1&&echo $A", "export A=1", "echo $A"),
+        ("source env.sh; python", None, "source env.sh; python"),
+        ("true && source env.sh", None, "true && source env.sh"),
+        (
+            'export A="1 && 2" && test "$A" = "1 && 2"',
+            None,
+            'export A="1 && 2" && test "$A" = "1 && 2"',
+        ),
+        (
+            "source /nonexist.sh && false || true",
+            None,
+            "source /nonexist.sh && false || true",
+        ),
+        ("source env.sh && a; b", None, "source env.sh && a; b"),
+        ("source env.sh && a & b", None, "source env.sh && a & b"),
+        (
+            "source env.sh && python -c 'a || b; c' 2>&1 | grep x",
+            "source env.sh",
+            "python -c 'a || b; c' 2>&1 | grep x",
+        ),
+    ],
+)
+def test_split_setup_prefix(check, setup, body):
+    assert _split_setup_prefix(check) == (setup, body)
+
+
+def test_run_session_setup():
+    status = {}
+    errors = {}
+    _run_session(
+        "",
+        "export SESSION_SETUP=1",
+        [
+            ("proc/a", "true", "setup a", '[ "$SESSION_SETUP" = 1 ]', False, None),
+            ("proc/b", "true", "setup b", "[ -z $SESSION_SETUP ]", False, None),
+        ],
+        status,
+        errors,
+    )
+    assert status["proc/a"] == CheckingStatus.SUCCESS
+    assert status["proc/b"] == CheckingStatus.ERROR
+
+    _run_session(
+        "",
+        "echo setup-failed >&2; false",
+        [
+            ("proc/c", "true", "setup c", "true", False, None),
+            ("proc/d", "true", "setup d", "true", False, None),
+        ],
+        status,
+        errors,
+    )
+    assert status["proc/c"] == status["proc/d"] == CheckingStatus.ERROR
+    assert errors["proc/c"] == "setup-failed\n"
+
+
+def test_run_check_limits():
+    status = {}
+    errors = {}
+    usage = _run_check(
+        "proc",
+        "limits",
+        "true",
+        "[ $(ulimit -n) = 64 ] && [ $(ulimit -t) = 5 ]",
+        status,
+        errors,
+        limits={"memory": None, "cputime": 5, "files": 64},
+    )
+    assert usage.wall > 0
+    assert usage.cpu >= 0
+
+    usage = _run_check(
+        "proc",
+        "limits_rss",
+        "true",
+        "python -c 'x = b\"1\" * (64 * 1024 * 1024)'",
+        status,
+        errors,
+    )
+    # Not reported when not above the peak inherited from the worker
+    if usage.maxrss is not None:
+        assert usage.maxrss > 64 * 1024 * 1024
+
+    with pytest.raises(CalledProcessError):
+        _run_check(
+            "proc",
+            "limits_mem",
+            "true",
+            "python -c 'x = bytearray(64 * 1024 * 1024)'",
+            status,
+            errors,
+            limits={"memory": 32 * 1024 * 1024},
+        )
+    assert "MemoryError" in errors["proc/limits_mem"]
+
+
+def test_run_check_killed():
+    status = {}
+    errors = {}
+    with pytest.raises(CalledProcessError):
+        _run_check(
+            "proc",
+            "killed",
+            "true",
+            "kill -TERM $$",
+            status,
+            errors,
+        )
+    assert "[Killed by SIGTERM]" in errors["proc/killed"]
+
+
+def test_run_session_limits():
+    status = {}
+    errors = {}
+    usage = _run_session(
+        "",
+        None,
+        [("proc/sl", "true", "session limits", "[ $(ulimit -n) = 64 ]", False, None)],
+        status,
+        errors,
+        limits={"files": 64},
+    )
+    assert status["proc/sl"] == CheckingStatus.SUCCESS
+    assert usage.durations["proc/sl"] > 0
@@ -0,0 +1,66 @@
+import pytest  # noqa
+
+from pipen_cli_require import scheduler
+from pipen_cli_require.scheduler import AdaptiveLimiter
+
+
+def test_observe():
+    limiter = AdaptiveLimiter(4)
+    assert limiter.max_capacity == 8
+    limiter.observe(0, 1)
+    assert limiter.cpu_ratio == 1.0
+    for _ in range(50):
+        limiter.observe(1.0, 0.0)
+    assert limiter.cpu_ratio < 0.01
+
+
+def test_capacity_load(monkeypatch):
+    monkeypatch.setattr(scheduler, "_memory", lambda: None)
+    limiter = AdaptiveLimiter(4)
+
+    monkeypatch.setattr(scheduler, "_loadavg", lambda: 0.0)
+    assert limiter.capacity(0) == 4
+
+    # Loaded by other processes
+    monkeypatch.setattr(scheduler, "_loadavg", lambda: 3.0)
+    assert limiter.capacity(0) == 1
+    # The running checks contribute to the load
+    assert limiter.capacity(2) == 3
+
+    # IO-bound checks oversubscribe the cores
+    monkeypatch.setattr(scheduler, "_loadavg", lambda: 0.0)
+    for _ in range(50):
+        limiter.observe(1.0, 0.0)
+    assert limiter.capacity(0) == 8
+
+
+def test_capacity_memory(monkeypatch):
+    monkeypatch.setattr(scheduler, "_loadavg", lambda: 0.0)
+    limiter = AdaptiveLimiter(4)
+
+    monkeypatch.setattr(scheduler, "_memory", lambda: (80, 100))
+    assert limiter.capacity(2) == 4
+    # Do not grow
+    monkeypatch.setattr(scheduler, "_memory", lambda: (8, 100))
+    assert limiter.capacity(2) == 2
+    # Shrink
+    monkeypatch.setattr(scheduler, "_memory", lambda: (4, 100))
+    assert limiter.capacity(2) == 1
+    assert limiter.capacity(0) == 1
+
+
+def test_cpu_count(monkeypatch):
+    monkeypatch.setattr(scheduler, "_cgroup_cores", lambda: None)
+    monkeypatch.setattr(scheduler.os, "sched_getaffinity", lambda pid: {0, 1, 2})
+    assert scheduler._cpu_count() == 3
+    # Limited by the CPU quota of the cgroup
+    monkeypatch.setattr(scheduler, "_cgroup_cores", lambda: 1.5)
+    assert scheduler._cpu_count() == 1
+    assert AdaptiveLimiter().cores == 1
+
+
+def test_max_workers():
+    assert AdaptiveLimiter(4).max_workers == 8
+    limiter = AdaptiveLimiter(128)
+    assert limiter.max_capacity == 256
+    assert limiter.max_workers == scheduler.AUTO_MAX_WORKERS
@@ -0,0 +1,75 @@
+import json
+import sys
+
+import pytest
+
+from pipen_cli_require.fingerprint import check_fingerprint, environment_fingerprint
+from pipen_cli_require.snapshot import (
+    load_snapshot,
+    reusable_results,
+    save_snapshot,
+)
+
+
+def test_check_fingerprint(tmp_path):
+    script = tmp_path / "check.sh"
+    script.write_text("true")
+    check = f"bash {script} && {sys.executable} -c 'import x'"
+    fingerprint = check_fingerprint(check)
+    assert len(fingerprint) == 16
+    assert check_fingerprint(check) == fingerprint
+    assert check_fingerprint(check + " ") != fingerprint
+    # Unbalanced quotes
+    assert len(check_fingerprint("echo 'x")) == 16
+
+    script.write_text("false")
+    assert check_fingerprint(check) != fingerprint
+
+
+def test_snapshot(tmp_path):
+    path = tmp_path / "snapshot.json"
+    script = tmp_path / "check.sh"
+    script.write_text("true")
+    save_snapshot(
+        path,
+        "pipeline",
+        {
+            f"bash {script}": {"status": "success", "error": None, "keys": ["P/a"]},
+            "false": {"status": "error", "error": "failed", "keys": ["P/b"]},
+        },
+    )
+    snapshot = load_snapshot(path)
+    assert snapshot.pipeline == "pipeline"
+    assert snapshot.fingerprint == environment_fingerprint()
+
+    # The failed checks are not reused
+    checks = [f"bash {script}", "false", "true"]
+    assert list(reusable_results(snapshot, checks)) == checks[:1]
+
+    # A different environment, nothing is reused
+    snapshot.fingerprint = "other"
+    assert list(reusable_results(snapshot, checks)) == []
+
+    # The same environment, but a file used by the check changed
+    snapshot.fingerprint = environment_fingerprint()
+    script.write_text("false")
+    assert list(reusable_results(snapshot, checks)) == []
+
+    # The same environment, but a file tested by the check is removed
+    marker = tmp_path / "marker"
+    marker.touch()
+    check = f"test -f {marker}"
+    save_snapshot(
+        path,
+        "pipeline",
+        {check: {"status": "success", "error": None, "keys": ["P/c"]}},
+    )
+    assert list(reusable_results(load_snapshot(path), [check])) == [check]
+    marker.unlink()
+    assert list(reusable_results(load_snapshot(path), [check])) == []
+
+    data = json.loads(path.read_text())
+    data["version"] = 0
+    path.write_text(json.dumps(data))
+    with pytest.raises(ValueError):
+        load_snapshot(path)